@@ -1,45 +1,139 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Query
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Query, Depends
 from fastapi.responses import JSONResponse
-import shutil
 import os
 import json
-import tempfile
-from app.services.analysis_service import analyze_with_gemini, analyze_with_gpt
+import asyncio
+from app.services.analysis_service import (
+    analyze_with_gemini,
+    analyze_with_gpt,
+    analyze_economy_with_gpt,
+    analyze_economy_with_gemini,
+    record_economy_escalation,
+    ANALYSIS_MODE,
+    ECONOMY_IMAGE_MAX_SIDE,
+)
 from app.services.market_price_service import get_market_price
+from app.services.image_service import run_image_task, prepare_analysis_image, encode_analysis_image
+from app.services.analysis_store import put_analysis
+from app.services.storage_service import spool_upload, UploadTooLarge
+from app.services.deadline import Deadline, DeadlineExceeded, get_request_deadline, run_with_deadline
 from app.schemas import ResponseModel, SeafoodStats
 from typing import Optional
 
 router = APIRouter()
 
+# Upper bound for the (optional) market price lookup, within the request deadline
+PRICE_LOOKUP_TIMEOUT = 10.0
+
+async def _call_llm(fn, *args, deadline: Deadline, **kwargs) -> str:
+    """Runs a blocking provider call in a thread, bounded by the remaining budget."""
+    result = await run_with_deadline(
+        asyncio.to_thread(fn, *args, timeout=deadline.budget(), **kwargs), deadline
+    )
+    # The analyzers turn SDK timeouts into error strings; report them as a deadline miss
+    if deadline.expired:
+        raise DeadlineExceeded()
+    return result
+
+async def _apply_market_price(data: dict, fish_name: str, est_weight_val: Optional[float], deadline: Deadline,
+                              latitude: Optional[float] = None, longitude: Optional[float] = None) -> bool:
+    """
+    Replaces data["marketPrice"] with real price * weight (regional price when coordinates are given).
+    Returns False if the lookup was skipped or cut off by the deadline
+    (data keeps the model's own estimate in that case).
+    """
+    budget = deadline.budget(PRICE_LOOKUP_TIMEOUT)
+    if budget <= 0:
+        return False
+    try:
+        unit_price_per_kg = await run_with_deadline(
+            get_market_price(fish_name, timeout=budget, latitude=latitude, longitude=longitude),
+            deadline, PRICE_LOOKUP_TIMEOUT
+        )
+    except DeadlineExceeded:
+        return False
+    if unit_price_per_kg is None and deadline.expired:
+        return False
+
+    if unit_price_per_kg is not None and est_weight_val is not None:
+         total_price = unit_price_per_kg * est_weight_val
+         data["marketPrice"] = int(total_price)
+    return True
+
+def _mark_partial(data: dict, stage: str):
+    data["partial"] = True
+    data.setdefault("timedOut", []).append(stage)
+
+async def _run_llm_analysis(temp_path: str, fish_length: Optional[float], deadline: Deadline) -> str:
+    """
+    Picks the configured provider (OpenAI first, then Gemini) and returns its raw output.
+    Image decoding / resizing / base64 encoding runs in the image process pool.
+    In economy mode a small low-detail pass runs first and the full pass only
+    runs if that answer is rejected.
+    Every stage only gets what is left of the request deadline.
+    """
+    openai_key = os.environ.get("OPENAI_API_KEY")
+    gemini_key = os.environ.get("GEMINI_API_KEY")
+    
+    if openai_key and openai_key.strip():
+        if ANALYSIS_MODE == "economy":
+            small_image = await run_with_deadline(
+                run_image_task(encode_analysis_image, temp_path, ECONOMY_IMAGE_MAX_SIDE), deadline
+            )
+            result = await _call_llm(analyze_economy_with_gpt, small_image, openai_key, fish_length=fish_length, deadline=deadline)
+            if result is not None:
+                return result
+            record_economy_escalation()
+        base64_image = await run_with_deadline(run_image_task(encode_analysis_image, temp_path), deadline)
+        return await _call_llm(analyze_with_gpt, temp_path, openai_key, fish_length=fish_length, base64_image=base64_image, deadline=deadline)
+    elif gemini_key and gemini_key.strip():
+        if ANALYSIS_MODE == "economy":
+            small_image = await run_with_deadline(
+                run_image_task(prepare_analysis_image, temp_path, ECONOMY_IMAGE_MAX_SIDE), deadline
+            )
+            result = await _call_llm(analyze_economy_with_gemini, small_image, gemini_key, fish_length=fish_length, deadline=deadline)
+            if result is not None:
+                return result
+            record_economy_escalation()
+        image_bytes = await run_with_deadline(run_image_task(prepare_analysis_image, temp_path), deadline)
+        return await _call_llm(analyze_with_gemini, temp_path, gemini_key, fish_length=fish_length, image_bytes=image_bytes, deadline=deadline)
+    else:
+        raise HTTPException(status_code=500, detail="No API Key (OpenAI or Gemini) configured on server")
+
+def _storable_analysis(data: dict, est_weight_val: Optional[float]) -> Optional[dict]:
+    """The record fields of an analysis, typed as /merchant/record stores them, or None."""
+    fish_name = data.get("seafoodType")
+    try:
+        market_price = int(float(data.get("marketPrice")))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(fish_name, str) or not fish_name or est_weight_val is None:
+        return None
+    scientific_name = data.get("scientific_name")
+    forbidden = data.get("currentlyForbidden")
+    return {
+        "seafoodType": fish_name,
+        "marketPrice": market_price,
+        "estimatedWeight": est_weight_val,
+        "scientific_name": scientific_name if isinstance(scientific_name, str) else None,
+        "currentlyForbidden": forbidden if isinstance(forbidden, bool) else None,
+    }
+
 @router.post("/analyze", response_model=ResponseModel)
 async def analyze_fish(
     image: UploadFile = File(...),
     fishLength: Optional[float] = Form(None),
+    latitude: Optional[float] = Form(None, description="Stall location, for the regional market price"),
+    longitude: Optional[float] = Form(None),
+    deadline: Deadline = Depends(get_request_deadline),
 ):
     try:
-        # Save uploaded file randomly to handle concurrency somewhat safely in simple use cases, 
-        # or just use a temp file.
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(image.filename)[1]) as temp_file:
-            shutil.copyfileobj(image.file, temp_file)
-            temp_path = temp_file.name
+        # Streamed to a temp file (size-capped like merchant uploads); the image pool
+        # workers read it from there
+        temp_path, _ = await spool_upload(image)
 
         try:
-            openai_key = os.environ.get("OPENAI_API_KEY")
-            gemini_key = os.environ.get("GEMINI_API_KEY")
-            
-            # Prioritize OpenAI if available (or change logic if user prefers Gemini)
-            # The user request implies checking existence.
-            # If ONLY one is present, use it. If both, pick one.
-            # Let's check keys.
-            
-            result_str = None
-            
-            if openai_key and openai_key.strip():
-                result_str = analyze_with_gpt(temp_path, openai_key, fish_length=fishLength)
-            elif gemini_key and gemini_key.strip():
-                result_str = analyze_with_gemini(temp_path, gemini_key, fish_length=fishLength)
-            else:
-                 raise HTTPException(status_code=500, detail="No API Key (OpenAI or Gemini) configured on server")
+            result_str = await _run_llm_analysis(temp_path, fishLength, deadline)
             
             clean_result = result_str.replace("```json", "").replace("```", "").strip()
             
@@ -56,7 +150,6 @@ async def analyze_fish(
                 # Fetch Real Market Price
                 if "seafoodType" in data:
                     fish_name = data["seafoodType"]
-                    unit_price_per_kg = await get_market_price(fish_name)
                     
                     est_weight_val = None
                     if "estimatedWeight" in data:
@@ -65,9 +158,9 @@ async def analyze_fish(
                          except (ValueError, TypeError):
                              pass
 
-                    if unit_price_per_kg is not None and est_weight_val is not None:
-                         total_price = unit_price_per_kg * est_weight_val
-                         data["marketPrice"] = int(total_price)
+                    # Optional stage: on timeout keep the model's estimate and flag the result
+                    if not await _apply_market_price(data, fish_name, est_weight_val, deadline, latitude, longitude):
+                        _mark_partial(data, "marketPrice")
                     
                     # Check Regulations
                     from app.services.regulation_service import check_regulation
@@ -81,6 +174,18 @@ async def analyze_fish(
                             
                     reg_result = check_regulation(fish_name, length_cm=fl_val, weight_kg=est_weight_val)
                     data["currentlyForbidden"] = reg_result["forbidden"]
+                    
+                    # Lets /merchant/record reuse this image and the trusted analysis values.
+                    # Values are stored already converted, and only when price and weight
+                    # are usable; otherwise (or when the image doesn't fit the store) there
+                    # is no token and the client submits the record fields itself.
+                    stored_analysis = _storable_analysis(data, est_weight_val)
+                    if stored_analysis is not None:
+                        with open(temp_path, "rb") as f:
+                            image_content = f.read()
+                        token = put_analysis(image_content, image.filename, image.content_type, stored_analysis)
+                        if token is not None:
+                            data["analysisToken"] = token
                 
                 return {
                     "status": "success",
@@ -99,6 +204,10 @@ async def analyze_fish(
 
     except HTTPException:
         raise
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504, detail="Analysis deadline exceeded")
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -112,10 +221,14 @@ async def compare_fillet(
     image2: UploadFile = File(...),
     length1: int = Form(...),
     length2: int = Form(...),
+    deadline: Deadline = Depends(get_request_deadline),
 ):
     try:
-        res1 = await _analyze_single_fish(image1, float(length1))
-        res2 = await _analyze_single_fish(image2, float(length2))
+        # Both fish share one deadline and are analyzed concurrently
+        res1, res2 = await asyncio.gather(
+            _analyze_single_fish(image1, float(length1), deadline),
+            _analyze_single_fish(image2, float(length2), deadline),
+        )
         
         fw1 = res1.get("filletWeights", 0.0)
         fw2 = res2.get("filletWeights", 0.0)
@@ -133,28 +246,21 @@ async def compare_fillet(
         }
     except HTTPException:
          raise
+    except DeadlineExceeded:
+         raise HTTPException(status_code=504, detail="Analysis deadline exceeded")
+    except UploadTooLarge as e:
+         raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
          import traceback
          traceback.print_exc()
          raise HTTPException(status_code=500, detail=str(e))
 
-async def _analyze_single_fish(image: UploadFile, length_val: float) -> dict:
+async def _analyze_single_fish(image: UploadFile, length_val: float, deadline: Deadline) -> dict:
     temp_path = None
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(image.filename)[1]) as temp_file:
-            shutil.copyfileobj(image.file, temp_file)
-            temp_path = temp_file.name
+        temp_path, _ = await spool_upload(image)
 
-        openai_key = os.environ.get("OPENAI_API_KEY")
-        gemini_key = os.environ.get("GEMINI_API_KEY")
-        
-        result_str = None
-        if openai_key and openai_key.strip():
-            result_str = analyze_with_gpt(temp_path, openai_key, fish_length=length_val)
-        elif gemini_key and gemini_key.strip():
-            result_str = analyze_with_gemini(temp_path, gemini_key, fish_length=length_val)
-        else:
-             raise HTTPException(status_code=500, detail="No API Key configured")
+        result_str = await _run_llm_analysis(temp_path, length_val, deadline)
         
         clean_result = result_str.replace("```json", "").replace("```", "").strip()
         data = json.loads(clean_result)
@@ -167,7 +273,6 @@ async def _analyze_single_fish(image: UploadFile, length_val: float) -> dict:
             fish_name = data["seafoodType"]
             
             # Market Price
-            unit_price_per_kg = await get_market_price(fish_name)
             est_weight_val = None
             if "estimatedWeight" in data:
                  try:
@@ -175,9 +280,8 @@ async def _analyze_single_fish(image: UploadFile, length_val: float) -> dict:
                  except (ValueError, TypeError):
                      pass
             
-            if unit_price_per_kg is not None and est_weight_val is not None:
-                 total_price = unit_price_per_kg * est_weight_val
-                 data["marketPrice"] = int(total_price)
+            if not await _apply_market_price(data, fish_name, est_weight_val, deadline):
+                _mark_partial(data, "marketPrice")
             
             # Regulations
             from app.services.regulation_service import check_regulation
@@ -1,42 +1,133 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Query, Depends
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Query, Depends, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from app.schemas import ResponseModel, Record, RecordDataResponse
 from typing import List, Optional
-from app.database import get_db
+from app.database import get_db, SessionLocal
 from app.models import MerchantRecord
-from app.services.storage_service import upload_file
+import os
+import zlib
+from contextlib import aclosing
+from app.services.storage_service import upload_file, compute_image_hash, spool_upload, UploadTooLarge
+from app.services.anomaly_service import scorer
+from app.services.market_price_service import peek_regional_price, peek_price_table, price_table_version
+from app.services.analysis_store import take_analysis, restore_analysis
+from app.services.deadline import Deadline, DeadlineExceeded, get_request_deadline, run_with_deadline
+from app.responses import FastJSONResponse, json_dumps, cache_headers, is_not_modified, not_modified_response
+from app.services.record_feed import broker, iter_feed, FeedFilter, FeedEvent, FEED_REPLAY_LIMIT
+from app.services.record_cache import (
+    get_record_row,
+    put_record_row,
+    bump_records_version,
+    record_etag,
+    records_list_etag,
+    get_page_state,
+    put_page_state,
+    RECORD_CACHE_MAX_AGE,
+)
+from app.services.cluster_service import (
+    get_clusters,
+    invalidate_record_tiles,
+    count_tiles_for_bbox,
+    MIN_ZOOM,
+    MAX_ZOOM,
+    MAX_TILES_PER_REQUEST,
+)
 
 router = APIRouter()
 
 @router.post("/record", response_model=ResponseModel)
 async def create_merchant_record(
-    image: UploadFile = File(...),
-    seafoodType: str = Form(...),
-    marketPrice: int = Form(...),
-    estimatedWeight: float = Form(...),
+    image: Optional[UploadFile] = File(None),
+    analysisToken: Optional[str] = Form(None, description="Token from /fish/analyze; replaces image and the analysis fields"),
+    seafoodType: Optional[str] = Form(None),
+    marketPrice: Optional[int] = Form(None),
+    estimatedWeight: Optional[float] = Form(None),
     merchantWeight: float = Form(...),
     latitude: float = Form(...),
     longitude: float = Form(...),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    deadline: Deadline = Depends(get_request_deadline)
 ):
+    scientific_name = None
+    currently_forbidden = None
+    stored = None
+    if analysisToken:
+        # Image and analysis values come from the server-side analysis, not the client.
+        # Taken (not just read) up front so the token can't be used by two requests;
+        # it is put back below if no record gets created.
+        stored = take_analysis(analysisToken)
+        if stored is None:
+            raise HTTPException(status_code=404, detail="Analysis token expired or not found")
+        analysis = stored.analysis
+        seafoodType = analysis.get("seafoodType")
+        marketPrice = analysis.get("marketPrice")
+        estimatedWeight = analysis.get("estimatedWeight")
+        if seafoodType is None or marketPrice is None or estimatedWeight is None:
+            # Can never produce a valid record, so the token is not put back
+            raise HTTPException(status_code=422, detail="Analysis for this token has no seafoodType, marketPrice or estimatedWeight")
+        scientific_name = analysis.get("scientific_name")
+        currently_forbidden = analysis.get("currentlyForbidden")
+        file_content = stored.image
+        filename, content_type = stored.filename, stored.content_type
+    else:
+        if image is None or seafoodType is None or marketPrice is None or estimatedWeight is None:
+            raise HTTPException(status_code=400, detail="Either analysisToken or image, seafoodType, marketPrice and estimatedWeight are required")
+        file_content = None
+        filename, content_type = image.filename, image.content_type
+
+    spooled_path = None
+    created = False
     try:
-        # Upload Image to Supabase Storage
-        file_content = await image.read()
-        image_url = await upload_file(file_content, image.filename, image.content_type)
+        # Upload Image to Supabase Storage (skipped if the same image is already stored)
+        if file_content is None:
+            # Stream the upload to a temp file while hashing; storage then streams from that file
+            spooled_path, image_hash = await spool_upload(image)
+            file_content = spooled_path
+        else:
+            image_hash = compute_image_hash(file_content)
+        existing = (
+            db.query(MerchantRecord.image_filename)
+            .filter(MerchantRecord.image_hash == image_hash, MerchantRecord.image_filename.isnot(None))
+            .first()
+        )
+        if existing:
+            image_url = existing.image_filename
+        else:
+            image_url = await run_with_deadline(
+                upload_file(file_content, filename, content_type, content_hash=image_hash, timeout=deadline.budget()),
+                deadline
+            )
+        
+        # Honesty check: declared weight vs AI estimate, scored against running stats
+        weight_zscore, is_anomaly = scorer.score(seafoodType, estimatedWeight, merchantWeight)
         
         new_record = MerchantRecord(
             seafood_type=seafoodType,
+            scientific_name=scientific_name,
             market_price=marketPrice,
             estimated_weight=estimatedWeight,
             merchant_weight=merchantWeight,
+            currently_forbidden=currently_forbidden,
             latitude=latitude,
             longitude=longitude,
-            image_filename=image_url # Storing URL in the filename column
+            image_filename=image_url, # Storing URL in the filename column
+            image_hash=image_hash,
+            weight_zscore=weight_zscore,
+            is_anomaly=is_anomaly
         )
         
         db.add(new_record)
         db.commit()
+        created = True
         db.refresh(new_record)
+        invalidate_record_tiles(new_record.latitude, new_record.longitude)
+        bump_records_version()
+        scorer.observe(seafoodType, estimatedWeight, merchantWeight, latitude, longitude, weight_zscore, is_anomaly)
+        row = _record_row(new_record)
+        put_record_row(new_record.id, row)
+        broker.publish(new_record.id, _map_row_to_detail(row), latitude, longitude, seafoodType)
         
         return {
             "status": "success",
@@ -45,12 +136,21 @@ async def create_merchant_record(
                 "msg": "success"
             }
         }
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504, detail="Image upload deadline exceeded")
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         print(f"Error creating record: {e}")
         return {
             "status": "error",
             "data": {"message": str(e)}
         }
+    finally:
+        if stored is not None and not created:
+            restore_analysis(analysisToken, stored)
+        if spooled_path and os.path.exists(spooled_path):
+            os.remove(spooled_path)
 
 from app.schemas import ResponseModel, Record, RecordDataResponse, RecordDetail
 
@@ -58,6 +158,7 @@ from app.schemas import ResponseModel, Record, RecordDataResponse, RecordDetail
 
 @router.get("/record", response_model=RecordDetail)
 async def get_merchant_record_detail(
+    request: Request,
     id: str = Query(..., description="Record ID"),
     db: Session = Depends(get_db)
 ):
@@ -66,33 +167,235 @@ async def get_merchant_record_detail(
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid ID format")
 
-    record = db.query(MerchantRecord).filter(MerchantRecord.id == record_id_int).first()
+    def load(record_id: int):
+        row = db.query(*_RECORD_DETAIL_COLUMNS).filter(MerchantRecord.id == record_id).first()
+        return tuple(row) if row else None
+
+    # Records are immutable once created, so their rows are served from an in-process LRU
+    row = get_record_row(record_id_int, load)
     
-    if not record:
+    if row is None:
         raise HTTPException(status_code=404, detail="Record not found")
     
-    return _map_record_to_detail(record)
+    # Only the regional price can change, and only when this species' price table is
+    # loaded or expires. So the ETag folds in that table's version, there is no
+    # Last-Modified (created_at would validate a stale price), and a response is
+    # fresh for as long as the table it was built from stays cached.
+    table = peek_price_table(row[_ROW_SEAFOOD_TYPE])
+    etag = record_etag(record_id_int, table.version if table else 0)
+    max_age = min(RECORD_CACHE_MAX_AGE, int(table.ttl_remaining())) if table else 0
+    headers = cache_headers(etag, f"public, max-age={max_age}" if max_age > 0 else "no-cache")
+    if is_not_modified(request, etag):
+        return not_modified_response(headers)
+
+    # Mapped per request: the regional price in it can change while the row can't
+    return FastJSONResponse(_map_row_to_detail(row), headers=headers)
 
 @router.get("/records", response_model=ResponseModel)
 async def get_merchant_records(
+    request: Request,
     page: Optional[int] = Query(1, ge=1),
     size: Optional[int] = Query(10, ge=1),
     db: Session = Depends(get_db)
 ):
+    # The ETag is derived from the ids on the page and the price table versions of
+    # their species. For RECORDS_PAGE_TTL after a page was queried (and until this
+    # worker inserts a record), a conditional request is answered from that memo
+    # without touching the DB.
+    state = get_page_state(page, size)
+    if state is not None:
+        rows_tag, species = state
+        etag = records_list_etag(page, size, rows_tag, _price_tag(species))
+        if is_not_modified(request, etag):
+            return not_modified_response(cache_headers(etag, "no-cache"))
+
     start = (page - 1) * size
-    records = db.query(MerchantRecord).offset(start).limit(size).all()
+    # Select only the columns we serialize; rows come back as plain tuples
+    # instead of full ORM objects.
+    rows = (
+        db.query(*_RECORD_DETAIL_COLUMNS)
+        .order_by(MerchantRecord.id)
+        .offset(start)
+        .limit(size)
+        .all()
+    )
     
-    mapped_records = [_map_record_to_detail(r) for r in records]
+    rows_tag = _digest(",".join(str(row[0]) for row in rows))
+    species = frozenset(row[_ROW_SEAFOOD_TYPE] for row in rows)
+    put_page_state(page, size, rows_tag, species)
+    etag = records_list_etag(page, size, rows_tag, _price_tag(species))
+    headers = cache_headers(etag, "no-cache")
+    if is_not_modified(request, etag):
+        return not_modified_response(headers)
+
+    mapped_records = [_map_row_to_detail(row) for row in rows]
     
-    return {
+    # Rows are already shaped like RecordDetail, so bypass response_model
+    # re-validation and serialize straight to bytes.
+    return FastJSONResponse({
         "status": "success",
         "data": {
             "record": mapped_records
         }
+    }, headers=headers)
+
+# Live feed of new records (instead of polling /records).
+# Both endpoints accept sinceId to resume after the last received recordId,
+# plus an optional bounding box (all four of minLat/minLng/maxLat/maxLng) and seafoodType.
+
+@router.get("/records/stream")
+async def stream_merchant_records(
+    request: Request,
+    sinceId: Optional[int] = Query(None, description="Resume after this recordId (defaults to Last-Event-ID)"),
+    minLat: Optional[float] = Query(None),
+    minLng: Optional[float] = Query(None),
+    maxLat: Optional[float] = Query(None),
+    maxLng: Optional[float] = Query(None),
+    seafoodType: Optional[str] = Query(None),
+):
+    """Server-Sent Events: one `record` event per newly committed record."""
+    feed_filter = _feed_filter(minLat, minLng, maxLat, maxLng, seafoodType)
+    if sinceId is None:
+        last_event_id = request.headers.get("last-event-id")
+        if last_event_id and last_event_id.isdigit():
+            sinceId = int(last_event_id)
+
+    async def events():
+        # aclosing: unsubscribe as soon as the client goes away, not when the generator is collected
+        async with aclosing(iter_feed(feed_filter, sinceId, _replay_records, _latest_record_id)) as feed:
+            async for event in feed:
+                if await request.is_disconnected():
+                    break
+                if event is None:
+                    yield b": ping\n\n"
+                    continue
+                yield b"id: %d\nevent: record\ndata: %s\n\n" % (event.record_id, json_dumps(event.record))
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.websocket("/records/ws")
+async def merchant_records_websocket(
+    websocket: WebSocket,
+    sinceId: Optional[int] = Query(None),
+    minLat: Optional[float] = Query(None),
+    minLng: Optional[float] = Query(None),
+    maxLat: Optional[float] = Query(None),
+    maxLng: Optional[float] = Query(None),
+    seafoodType: Optional[str] = Query(None),
+):
+    """WebSocket variant: {"type": "record", "recordId", "record"} messages, {"type": "ping"} while idle."""
+    try:
+        feed_filter = _feed_filter(minLat, minLng, maxLat, maxLng, seafoodType)
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=e.detail)
+        return
+
+    await websocket.accept()
+    try:
+        async with aclosing(iter_feed(feed_filter, sinceId, _replay_records, _latest_record_id)) as feed:
+            async for event in feed:
+                if event is None:
+                    await websocket.send_text('{"type":"ping"}')
+                    continue
+                await websocket.send_bytes(json_dumps({
+                    "type": "record",
+                    "recordId": event.record_id,
+                    "record": event.record
+                }))
+    except WebSocketDisconnect:
+        pass
+
+def _feed_filter(min_lat, min_lng, max_lat, max_lng, seafood_type) -> FeedFilter:
+    bbox_values = (min_lat, min_lng, max_lat, max_lng)
+    bbox = None
+    if any(v is not None for v in bbox_values):
+        if any(v is None for v in bbox_values) or min_lat > max_lat or min_lng > max_lng:
+            raise HTTPException(status_code=400, detail="Invalid bounding box")
+        bbox = bbox_values
+    return FeedFilter(bbox=bbox, seafood_type=seafood_type)
+
+# Feed DB helpers. Blocking; iter_feed runs them in a worker thread.
+# Streams outlive request-scoped sessions, so each call uses its own short session.
+
+def _latest_record_id() -> int:
+    db = SessionLocal()
+    try:
+        return db.query(func.max(MerchantRecord.id)).scalar() or 0
+    finally:
+        db.close()
+
+def _replay_records(after_id: int, feed_filter: FeedFilter) -> List[FeedEvent]:
+    db = SessionLocal()
+    try:
+        query = db.query(*_RECORD_DETAIL_COLUMNS).filter(MerchantRecord.id > after_id)
+        if feed_filter.seafood_type:
+            query = query.filter(MerchantRecord.seafood_type == feed_filter.seafood_type)
+        if feed_filter.bbox:
+            min_lat, min_lng, max_lat, max_lng = feed_filter.bbox
+            query = query.filter(
+                MerchantRecord.latitude.between(min_lat, max_lat),
+                MerchantRecord.longitude.between(min_lng, max_lng),
+            )
+        rows = query.order_by(MerchantRecord.id).limit(FEED_REPLAY_LIMIT).all()
+        return [FeedEvent(row[0], _map_row_to_detail(row)) for row in rows]
+    finally:
+        db.close()
+
+@router.get("/records/clusters", response_model=ResponseModel)
+async def get_merchant_record_clusters(
+    minLat: float = Query(..., ge=-90, le=90),
+    minLng: float = Query(..., ge=-180, le=180),
+    maxLat: float = Query(..., ge=-90, le=90),
+    maxLng: float = Query(..., ge=-180, le=180),
+    zoom: int = Query(..., ge=MIN_ZOOM, le=MAX_ZOOM),
+    db: Session = Depends(get_db)
+):
+    """
+    Map clusters for a bounding box: count, dominant seafoodType and average price per cluster.
+    """
+    if minLat > maxLat or minLng > maxLng:
+        raise HTTPException(status_code=400, detail="Invalid bounding box")
+    if count_tiles_for_bbox(minLat, minLng, maxLat, maxLng, zoom) > MAX_TILES_PER_REQUEST:
+        raise HTTPException(status_code=400, detail="Bounding box too large for this zoom level")
+
+    clusters = get_clusters(minLat, minLng, maxLat, maxLng, zoom, db)
+    
+    return FastJSONResponse({
+        "status": "success",
+        "data": {
+            "zoom": zoom,
+            "clusters": clusters
+        }
+    })
+
+@router.get("/anomalies/stalls", response_model=ResponseModel)
+async def get_anomalous_stalls(
+    limit: int = Query(10, ge=1, le=100)
+):
+    """
+    Stalls ranked by mean declared-weight z-score, from the in-memory scorer state (no DB query).
+    Per worker: records inserted through other workers since startup are not included.
+    """
+    return {
+        "status": "success",
+        "data": {
+            "stalls": scorer.top_stalls(limit)
+        }
     }
 
-from app.schemas import PathRequest, PathResponse
-from app.services.path_service import calculate_best_path
+from app.schemas import PathRequest, PathResponse, RouteSessionResponse, RoutePointRequest
+from app.services.path_service import (
+    calculate_best_path,
+    create_route_session,
+    get_route_session,
+    add_route_point,
+    remove_route_point,
+    delete_route_session,
+)
 
 @router.post("/records/path", response_model=PathResponse)
 async def generate_best_path(
@@ -102,23 +405,107 @@ async def generate_best_path(
     sorted_points = calculate_best_path(request.points, db)
     return {"points": sorted_points}
 
+# Route sessions: the tour and its distance matrix stay in memory, so adding or
+# removing a stall only does an incremental update instead of a full recompute.
+
+@router.post("/records/path/session", response_model=RouteSessionResponse)
+async def create_path_session(
+    request: PathRequest,
+    db: Session = Depends(get_db)
+):
+    session = create_route_session(request.points, db)
+    return {"routeId": session.route_id, "points": session.path}
+
+@router.get("/records/path/session/{routeId}", response_model=RouteSessionResponse)
+async def get_path_session(routeId: str):
+    session = _get_route_session_or_404(routeId)
+    return {"routeId": session.route_id, "points": session.path}
+
+@router.post("/records/path/session/{routeId}/points", response_model=RouteSessionResponse)
+async def add_path_session_point(
+    routeId: str,
+    request: RoutePointRequest,
+    db: Session = Depends(get_db)
+):
+    session = _get_route_session_or_404(routeId)
+    if not add_route_point(session, request.point, db):
+        raise HTTPException(status_code=404, detail="Record not found")
+    return {"routeId": session.route_id, "points": session.path}
+
+@router.delete("/records/path/session/{routeId}/points/{point}", response_model=RouteSessionResponse)
+async def remove_path_session_point(routeId: str, point: int):
+    session = _get_route_session_or_404(routeId)
+    if not remove_route_point(session, point):
+        raise HTTPException(status_code=404, detail="Point not in route")
+    return {"routeId": session.route_id, "points": session.path}
+
+@router.delete("/records/path/session/{routeId}")
+async def delete_path_session(routeId: str):
+    if not delete_route_session(routeId):
+        raise HTTPException(status_code=404, detail="Route not found")
+    return {"status": "success"}
+
+def _get_route_session_or_404(route_id: str):
+    session = get_route_session(route_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Route not found")
+    return session
+
+# Column order must match the tuple unpacking in _map_row_to_detail
+_RECORD_DETAIL_COLUMNS = (
+    MerchantRecord.id,
+    MerchantRecord.image_filename,
+    MerchantRecord.merchant_weight,
+    MerchantRecord.latitude,
+    MerchantRecord.longitude,
+    MerchantRecord.seafood_type,
+    MerchantRecord.market_price,
+    MerchantRecord.estimated_weight,
+    MerchantRecord.currently_forbidden,
+    MerchantRecord.scientific_name,
+)
+
+_ROW_SEAFOOD_TYPE = 5  # index of seafood_type in _RECORD_DETAIL_COLUMNS
+
+def _record_row(r: MerchantRecord) -> tuple:
+    return tuple(getattr(r, column.key) for column in _RECORD_DETAIL_COLUMNS)
+
 def _map_record_to_detail(r: MerchantRecord) -> dict:
+    return _map_row_to_detail(_record_row(r))
+
+def _map_row_to_detail(row) -> dict:
+    """The RecordDetail shape. Every record view (detail, list, feed) is built here."""
+    (record_id, image_filename, merchant_weight, latitude, longitude,
+     seafood_type, market_price, estimated_weight, currently_forbidden, scientific_name) = row
     return {
-        "recordId": str(r.id),
-        "image": r.image_filename if r.image_filename else "",
-        "merchantWeight": str(r.merchant_weight),
+        "recordId": str(record_id),
+        "image": image_filename if image_filename else "",
+        "merchantWeight": str(merchant_weight),
         "data": {
             "location": {
-                "latitude": r.latitude,
-                "longitude": r.longitude
+                "latitude": latitude,
+                "longitude": longitude
             }
         },
         "stats": {
-            "seafoodType": r.seafood_type,
-            "marketPrice": r.market_price,
-            "estimatedWeight": r.estimated_weight,
-            # currentlyForbidden not stored in DB currently, returning None
-            "currentlyForbidden": None
+            "seafoodType": seafood_type,
+            "marketPrice": market_price,
+            "estimatedWeight": estimated_weight,
+            # Only known for records created from an analysis token
+            "currentlyForbidden": currently_forbidden,
+            "scientificName": scientific_name,
+            "regionalPrice": _regional_price(seafood_type, latitude, longitude)
         }
     }
 
+def _digest(text: str) -> str:
+    return format(zlib.crc32(text.encode("utf-8")), "08x")
+
+def _price_tag(species) -> str:
+    """Short digest of the price table versions of a set of species."""
+    return _digest(",".join(f"{s}:{price_table_version(s)}" for s in sorted(species, key=str)))
+
+def _regional_price(seafood_type, latitude, longitude):
+    # Cache-only lookup: record views never trigger an upstream price request
+    price = peek_regional_price(seafood_type, latitude, longitude)
+    return int(price) if price is not None else None
@@ -0,0 +1,38 @@
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from app.services.image_service import get_image_pool_stats
+from app.services.analysis_service import get_analysis_stats
+from app.services import profiler
+
+router = APIRouter()
+
+@router.get("/metrics")
+async def get_metrics():
+    """In-process runtime metrics for this worker."""
+    return {
+        "imagePool": get_image_pool_stats(),
+        "analysis": get_analysis_stats(),
+    }
+
+def require_profiling_token(x_profile_token: Optional[str] = Header(None)):
+    if not profiler.PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    if not profiler.check_token(x_profile_token):
+        raise HTTPException(status_code=403, detail="Invalid profiling token")
+
+@router.get("/profiles", dependencies=[Depends(require_profiling_token)])
+async def list_request_profiles():
+    """Recently profiled requests of this worker, newest first."""
+    return {"profiles": profiler.list_profiles()}
+
+@router.get("/profiles/{profile_id}", response_class=PlainTextResponse, dependencies=[Depends(require_profiling_token)])
+async def get_request_profile(
+    profile_id: int,
+    kind: Optional[str] = Query(None, pattern="^(cpu|await)$", description="Only on-CPU or only awaiting samples")
+):
+    """Collapsed stacks of one profile (input for flamegraph.pl / speedscope)."""
+    profile = profiler.get_profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(profile.collapsed(kind))
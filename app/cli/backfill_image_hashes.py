@@ -0,0 +1,66 @@
+"""
+Fills MerchantRecord.image_hash for records created before image deduplication.
+Existing objects stay where they are; new uploads of the same image reuse their URL.
+
+Usage:
+    python -m app.cli.backfill_image_hashes [--batch-size 100] [--dry-run]
+"""
+import argparse
+import httpx
+from app.database import SessionLocal, add_missing_columns
+from app.models import MerchantRecord
+from app.services.storage_service import compute_image_hash
+
+
+def backfill(batch_size: int = 100, dry_run: bool = False) -> int:
+    add_missing_columns(MerchantRecord.__table__)
+
+    db = SessionLocal()
+    updated = 0
+    failed = 0
+    skip = set()  # ids that stay NULL in this run (download failed / dry run)
+    try:
+        with httpx.Client(timeout=30.0, follow_redirects=True) as client:
+            while True:
+                query = db.query(MerchantRecord).filter(
+                    MerchantRecord.image_hash.is_(None),
+                    MerchantRecord.image_filename.isnot(None),
+                    MerchantRecord.image_filename != "",
+                )
+                if skip:
+                    query = query.filter(MerchantRecord.id.notin_(skip))
+                records = query.order_by(MerchantRecord.id).limit(batch_size).all()
+                if not records:
+                    break
+
+                for record in records:
+                    try:
+                        response = client.get(record.image_filename)
+                        response.raise_for_status()
+                    except Exception as e:
+                        print(f"[{record.id}] download failed: {e}")
+                        failed += 1
+                        skip.add(record.id)
+                        continue
+                    record.image_hash = compute_image_hash(response.content)
+                    updated += 1
+                    print(f"[{record.id}] {record.image_hash}")
+
+                if dry_run:
+                    db.rollback()
+                    skip.update(r.id for r in records)
+                else:
+                    db.commit()
+    finally:
+        db.close()
+
+    print(f"Done. hashed={updated} failed={failed} dry_run={dry_run}")
+    return updated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill image_hash for existing merchant records")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    backfill(batch_size=args.batch_size, dry_run=args.dry_run)
@@ -0,0 +1,245 @@
+"""
+Offline batch analysis of archived images (e.g. after a prompt or FISH_LWR_CONSTANTS change).
+Runs the same pipeline as /fish/analyze (provider -> scientific weight -> market price ->
+regulation check) with bounded concurrency and a provider rate limit, appending one JSON
+line per image to the output file. Re-running with the same output resumes: images that
+already have an "ok" line are skipped.
+
+Usage:
+    python -m app.cli.batch_analyze <image dir | manifest.jsonl | manifest.csv> -o results.jsonl
+        [--concurrency 4] [--rpm 60] [--provider auto|openai|gemini|stub] [--no-price]
+
+Manifest rows have "path" (relative to the manifest) and optional "fishLength",
+"latitude", "longitude".
+"""
+import os
+import csv
+import json
+import time
+import asyncio
+import argparse
+from typing import List, Optional, Set
+
+from app.services.analysis_service import analyze_with_gpt, analyze_with_gemini
+from app.services.fish_data import calculate_weight
+from app.services.image_service import (
+    start_image_pool,
+    shutdown_image_pool,
+    run_image_task,
+    encode_analysis_image,
+    prepare_analysis_image,
+)
+from app.services.market_price_service import get_market_price
+from app.services.regulation_service import check_regulation
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+
+
+def load_jobs(source: str) -> List[dict]:
+    """Image directory (recursive) or manifest -> list of {"path", "fishLength", "latitude", "longitude"}."""
+    if os.path.isdir(source):
+        jobs = []
+        for root, _, files in os.walk(source):
+            for name in files:
+                if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                    jobs.append({"path": os.path.join(root, name)})
+        return sorted(jobs, key=lambda j: j["path"])
+
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, encoding="utf-8") as f:
+        if source.endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+
+    jobs = []
+    for row in rows:
+        job = {"path": os.path.join(base, row["path"])}
+        for key in ("fishLength", "latitude", "longitude"):
+            if row.get(key) not in (None, ""):
+                job[key] = float(row[key])
+        jobs.append(job)
+    return jobs
+
+
+def load_completed(output_path: str) -> Set[str]:
+    """Paths that already have a successful result in the output file (checkpoint)."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue  # partial last line from an interrupted run
+            if row.get("status") == "ok":
+                done.add(row["path"])
+    return done
+
+
+def _ends_mid_line(path: str) -> bool:
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return False
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) != b"\n"
+
+
+class RateLimiter:
+    """Spaces out provider calls to at most rpm per minute (0 = unlimited)."""
+
+    def __init__(self, rpm: int):
+        self.interval = 60.0 / rpm if rpm > 0 else 0.0
+        self.next_at = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self.lock:
+            now = time.monotonic()
+            if self.next_at > now:
+                await asyncio.sleep(self.next_at - now)
+            self.next_at = max(now, self.next_at) + self.interval
+
+
+def analyze_with_stub(image_path, api_key=None, fish_length=None, **kwargs):
+    """Stand-in provider: deterministic answer, no network. For tests and dry runs."""
+    data = {
+        "is_fish": True,
+        "scientific_name": "Scomber japonicus",
+        "seafoodType": "고등어",
+        "marketPrice": 30000,
+        "estimatedWeight": 0.5,
+    }
+    if fish_length:
+        data["estimatedWeight"] = round(calculate_weight(data["scientific_name"], float(fish_length)), 2)
+    return json.dumps(data, ensure_ascii=False)
+
+
+def pick_provider(name: str):
+    """Returns (provider name, api key)."""
+    openai_key = (os.environ.get("OPENAI_API_KEY") or "").strip()
+    gemini_key = (os.environ.get("GEMINI_API_KEY") or "").strip()
+    if name == "auto":
+        name = "openai" if openai_key else "gemini" if gemini_key else None
+        if name is None:
+            raise SystemExit("No API Key (OpenAI or Gemini) configured; use --provider stub for a dry run")
+    key = {"openai": openai_key, "gemini": gemini_key, "stub": ""}[name]
+    if name != "stub" and not key:
+        raise SystemExit(f"No API key configured for provider '{name}'")
+    return name, key
+
+
+async def _call_provider(provider: str, api_key: str, job: dict) -> str:
+    path, fish_length = job["path"], job.get("fishLength")
+    if provider == "openai":
+        base64_image = await run_image_task(encode_analysis_image, path)
+        return await asyncio.to_thread(analyze_with_gpt, path, api_key, fish_length=fish_length, base64_image=base64_image)
+    if provider == "gemini":
+        image_bytes = await run_image_task(prepare_analysis_image, path)
+        return await asyncio.to_thread(analyze_with_gemini, path, api_key, fish_length=fish_length, image_bytes=image_bytes)
+    # The stub still prepares the image, so stub runs exercise the pool and catch unreadable files
+    await run_image_task(prepare_analysis_image, path)
+    return analyze_with_stub(path, fish_length=fish_length)
+
+
+async def analyze_one(job: dict, provider: str, api_key: str, limiter: RateLimiter, use_price: bool) -> dict:
+    await limiter.wait()
+    result_str = await _call_provider(provider, api_key, job)
+
+    clean_result = result_str.replace("```json", "").replace("```", "").strip()
+    try:
+        data = json.loads(clean_result)
+    except ValueError:
+        raise ValueError(f"Unparseable provider output: {result_str[:200]}")
+
+    if data.get("is_fish") is False or "seafoodType" not in data:
+        return data
+
+    fish_name = data["seafoodType"]
+    est_weight_val = None
+    try:
+        est_weight_val = float(data["estimatedWeight"])
+    except (KeyError, ValueError, TypeError):
+        pass
+
+    if use_price:
+        unit_price_per_kg = await get_market_price(fish_name, latitude=job.get("latitude"), longitude=job.get("longitude"))
+        if unit_price_per_kg is not None and est_weight_val is not None:
+            data["marketPrice"] = int(unit_price_per_kg * est_weight_val)
+
+    reg_result = check_regulation(fish_name, length_cm=job.get("fishLength"), weight_kg=est_weight_val)
+    data["currentlyForbidden"] = reg_result["forbidden"]
+    return data
+
+
+async def run_batch(jobs: List[dict], output_path: str, concurrency: int = 4, rpm: int = 60,
+                    provider: str = "auto", use_price: bool = True, progress_every: int = 50) -> dict:
+    provider, api_key = pick_provider(provider)
+    completed = load_completed(output_path)
+    pending = [j for j in jobs if j["path"] not in completed]
+    print(f"{len(jobs)} images, {len(jobs) - len(pending)} already done, {len(pending)} to analyze with {provider}")
+
+    limiter = RateLimiter(rpm)
+    semaphore = asyncio.Semaphore(concurrency)
+    stats = {"ok": 0, "error": 0, "skipped": len(jobs) - len(pending)}
+    start = time.monotonic()
+
+    start_image_pool()
+    try:
+        with open(output_path, "a", encoding="utf-8") as out:
+            if _ends_mid_line(output_path):
+                out.write("\n")  # terminate the partial line of an interrupted run
+            async def worker(job):
+                async with semaphore:
+                    try:
+                        data = await analyze_one(job, provider, api_key, limiter, use_price)
+                        row = {"path": job["path"], "status": "ok", "data": data}
+                    except Exception as e:
+                        row = {"path": job["path"], "status": "error", "error": str(e)}
+                # One line per image, flushed right away: this is the checkpoint
+                out.write(json.dumps(row, ensure_ascii=False) + "\n")
+                out.flush()
+                stats[row["status"]] += 1
+                done = stats["ok"] + stats["error"]
+                if progress_every and done % progress_every == 0:
+                    elapsed = time.monotonic() - start
+                    print(f"  {done}/{len(pending)} ({done / elapsed:.2f} img/s)")
+
+            await asyncio.gather(*(worker(job) for job in pending))
+    finally:
+        shutdown_image_pool()
+
+    elapsed = time.monotonic() - start
+    processed = stats["ok"] + stats["error"]
+    stats["elapsed_s"] = round(elapsed, 2)
+    stats["images_per_s"] = round(processed / elapsed, 2) if elapsed > 0 else 0.0
+    print(f"Done. ok={stats['ok']} error={stats['error']} skipped={stats['skipped']} "
+          f"in {stats['elapsed_s']}s ({stats['images_per_s']} img/s)")
+    return stats
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Batch fish image analysis with resumable JSONL output")
+    parser.add_argument("source", help="Image directory or manifest (.jsonl / .csv)")
+    parser.add_argument("-o", "--output", required=True, help="JSONL output (appended; also the checkpoint)")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rpm", type=int, default=60, help="Max provider requests per minute (0 = unlimited)")
+    parser.add_argument("--provider", choices=["auto", "openai", "gemini", "stub"], default="auto")
+    parser.add_argument("--no-price", action="store_true", help="Skip the market price lookup")
+    args = parser.parse_args(argv)
+
+    jobs = load_jobs(args.source)
+    return asyncio.run(run_batch(
+        jobs, args.output,
+        concurrency=args.concurrency,
+        rpm=args.rpm,
+        provider=args.provider,
+        use_price=not args.no_price,
+    ))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker, declarative_base
 import os
 from dotenv import load_dotenv
@@ -18,3 +18,23 @@ def get_db():
         yield db
     finally:
         db.close()
+
+def add_missing_columns(table):
+    """
+    create_all() only creates missing tables, it never alters existing ones.
+    Adds columns/indexes that were added to the model after the table was created.
+    New columns must be nullable.
+    """
+    inspector = inspect(engine)
+    if not inspector.has_table(table.name):
+        return
+
+    existing = {c["name"] for c in inspector.get_columns(table.name)}
+    with engine.begin() as conn:
+        for column in table.columns:
+            if column.name not in existing:
+                col_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}"))
+
+    for index in table.indexes:
+        index.create(bind=engine, checkfirst=True)
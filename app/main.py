@@ -1,14 +1,29 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from app.api.endpoints import fish, merchant
+from app.api.endpoints import fish, merchant, system
 from dotenv import load_dotenv
 from app import models
-from app.database import engine
+from app.database import engine, add_missing_columns, SessionLocal
+from app.services.image_service import start_image_pool, shutdown_image_pool
+from app.services import anomaly_service, profiler
 
 load_dotenv()
 
 models.Base.metadata.create_all(bind=engine)
+add_missing_columns(models.MerchantRecord.__table__)
 
-app = FastAPI(title="Fish Analysis API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start_image_pool()
+    db = SessionLocal()
+    try:
+        anomaly_service.warm_up(db)
+    finally:
+        db.close()
+    yield
+    shutdown_image_pool()
+
+app = FastAPI(title="Fish Analysis API", lifespan=lifespan)
 
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -20,8 +35,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Installed only when PROFILING_TOKEN is set, so disabled profiling costs nothing
+if profiler.PROFILING_ENABLED:
+    app.add_middleware(profiler.ProfilingMiddleware)
+
 app.include_router(fish.router, prefix="/api/v1/fish", tags=["Fish"])
 app.include_router(merchant.router, prefix="/api/v1/merchant", tags=["Merchant"])
+app.include_router(system.router, prefix="/api/v1/system", tags=["System"])
 
 if __name__ == "__main__":
     import uvicorn
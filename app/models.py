@@ -1,16 +1,27 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime
+from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, Index
 from sqlalchemy.sql import func
 from app.database import Base
 
 class MerchantRecord(Base):
     __tablename__ = "merchant_records"
+    __table_args__ = (
+        # Bounding-box lookups for map clustering
+        Index("ix_merchant_records_lat_lng", "latitude", "longitude"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     seafood_type = Column(String, index=True)
+    scientific_name = Column(String, nullable=True)
     market_price = Column(Integer)
     estimated_weight = Column(Float)
     merchant_weight = Column(Float)
+    currently_forbidden = Column(Boolean, nullable=True)
     latitude = Column(Float)
     longitude = Column(Float)
     image_filename = Column(String, nullable=True)
+    # sha256 of the uploaded image; records with the same photo share one stored object
+    image_hash = Column(String(64), nullable=True, index=True)
+    # Declared-vs-estimated weight z-score at insert time (see anomaly_service)
+    weight_zscore = Column(Float, nullable=True)
+    is_anomaly = Column(Boolean, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
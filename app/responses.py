@@ -0,0 +1,56 @@
+import json
+from typing import Any
+
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON response for already-shaped payloads (plain dict/list/str/int/float).
+    Uses orjson when installed, otherwise falls back to the stdlib encoder.
+    Returning this directly from an endpoint skips response_model validation,
+    so only use it with data that already matches the declared schema.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return json_dumps(content)
+
+
+def json_dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def cache_headers(etag: str, cache_control: str) -> dict:
+    return {"ETag": etag, "Cache-Control": cache_control}
+
+
+def _strip_weak(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    """
+    Conditional GET check against If-None-Match (weak comparison).
+    Record views are validated by ETag only: their regional price can change
+    without a meaningful modification date.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    current = _strip_weak(etag)
+    return any(_strip_weak(tag) == current for tag in if_none_match.split(","))
+
+
+def not_modified_response(headers: dict) -> Response:
+    return Response(status_code=304, headers=headers)
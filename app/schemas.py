@@ -13,6 +13,8 @@ class SeafoodStats(BaseModel):
     marketPrice: int
     estimatedWeight: float
     currentlyForbidden: Optional[bool] = None
+    scientificName: Optional[str] = None
+    regionalPrice: Optional[int] = None  # per kg, nearest region's current market price
 
 class Record(BaseModel):
     recordId: int
@@ -37,3 +39,10 @@ class PathRequest(BaseModel):
 
 class PathResponse(BaseModel):
     points: List[int]
+
+class RouteSessionResponse(BaseModel):
+    routeId: str
+    points: List[int]
+
+class RoutePointRequest(BaseModel):
+    point: int
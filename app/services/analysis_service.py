@@ -1,6 +1,17 @@
 import os
+import time
 import base64
 import traceback
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# "standard": always one full-resolution pass.
+# "economy": a small low-detail pass first, re-run at full resolution only when
+# the answer fails schema validation or its confidence is below ECONOMY_MIN_CONFIDENCE.
+ANALYSIS_MODE = os.environ.get("ANALYSIS_MODE", "standard")
+ECONOMY_IMAGE_MAX_SIDE = int(os.environ.get("ECONOMY_IMAGE_MAX_SIDE", "512"))
+ECONOMY_MIN_CONFIDENCE = float(os.environ.get("ECONOMY_MIN_CONFIDENCE", "0.7"))
 
 def encode_image(image_path):
     """Encodes an image to base64."""
@@ -10,22 +21,41 @@ def encode_image(image_path):
 from app.services.fish_data import calculate_weight
 import json
 
-def analyze_with_gemini(image_path, api_key, fish_length=None):
-    """Analyzes an image using Google Gemini (via google-genai SDK)."""
+def _openai_client(OpenAI, api_key, timeout):
+    if timeout is None:
+        return OpenAI(api_key=api_key)
+    # No retries: a retry could not fit in the remaining request budget anyway
+    return OpenAI(api_key=api_key, timeout=timeout, max_retries=0)
+
+def _gemini_client(genai, api_key, timeout):
+    if timeout is None:
+        return genai.Client(api_key=api_key)
+    return genai.Client(api_key=api_key, http_options={"timeout": max(int(timeout * 1000), 1)})
+
+def analyze_with_gemini(image_path, api_key, fish_length=None, image_bytes=None, timeout=None):
+    """
+    Analyzes an image using Google Gemini (via google-genai SDK).
+    image_bytes: optional JPEG already prepared by image_service (skips decoding here).
+    timeout: seconds left in the request budget (None = SDK default).
+    """
     try:
         from google import genai
     except ImportError:
         return "Error: google-genai is not installed. Please run: pip install google-genai"
 
-    client = genai.Client(api_key=api_key)
+    client = _gemini_client(genai, api_key, timeout)
 
     print(f"Analyzing {image_path} with Gemini...")
     
     length_info = f" The estimated length of the fish is {fish_length}cm." if fish_length else ""
 
     try:
-        import PIL.Image
-        img = PIL.Image.open(image_path)
+        if image_bytes is not None:
+            from google.genai import types
+            img = types.Part.from_bytes(data=image_bytes, mime_type="image/jpeg")
+        else:
+            import PIL.Image
+            img = PIL.Image.open(image_path)
         
         prompt = (
             "이 이미지를 분석하여 어종을 식별해 주세요. 대부분의 이미지는 한국 어시장에서 흔히 볼 수 있는 어종입니다. "
@@ -37,6 +67,7 @@ def analyze_with_gemini(image_path, api_key, fish_length=None):
             "JSON 형식만 반환하세요."
         )
 
+        start = time.perf_counter()
         response = client.models.generate_content(
             model='gemini-2.0-flash',
             contents=[prompt, img],
@@ -44,6 +75,7 @@ def analyze_with_gemini(image_path, api_key, fish_length=None):
                 'response_mime_type': 'application/json'
             }
         )
+        _record_gemini_usage("full", start, response)
         
         result_text = response.text
         
@@ -68,16 +100,21 @@ def analyze_with_gemini(image_path, api_key, fish_length=None):
     except Exception as e:
         return f"Gemini Error: {e}"
 
-def analyze_with_gpt(image_path, api_key, fish_length=None):
-    """Analyzes an image using OpenAI GPT-4o."""
+def analyze_with_gpt(image_path, api_key, fish_length=None, base64_image=None, timeout=None):
+    """
+    Analyzes an image using OpenAI GPT-4o.
+    base64_image: optional image already encoded by image_service (skips encoding here).
+    timeout: seconds left in the request budget (None = SDK default).
+    """
     try:
         from openai import OpenAI
     except ImportError:
         return "Error: openai is not installed. Please run: pip install openai"
 
-    client = OpenAI(api_key=api_key)
+    client = _openai_client(OpenAI, api_key, timeout)
     
-    base64_image = encode_image(image_path)
+    if base64_image is None:
+        base64_image = encode_image(image_path)
     
     length_info = f" The estimated length of the fish is {fish_length}cm." if fish_length else ""
 
@@ -93,6 +130,7 @@ def analyze_with_gpt(image_path, api_key, fish_length=None):
     )
 
     try:
+        start = time.perf_counter()
         response = client.chat.completions.create(
             model="gpt-4o",
             messages=[
@@ -112,6 +150,7 @@ def analyze_with_gpt(image_path, api_key, fish_length=None):
             response_format={"type": "json_object"},
             max_tokens=300,
         )
+        _record_openai_usage("full", start, response)
         result_text = response.choices[0].message.content
         
         # Post-process for scientific weight calculation
@@ -130,3 +169,191 @@ def analyze_with_gpt(image_path, api_key, fish_length=None):
         return result_text
     except Exception as e:
         return f"GPT Error: {e}\n{traceback.format_exc()}"
+
+# --- Per-tier stats ---
+
+_tier_stats = {
+    tier: {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_latency_ms": 0.0}
+    for tier in ("economy", "full")
+}
+_economy_escalations = 0
+
+def _record_tier(tier, start, prompt_tokens, completion_tokens):
+    stats = _tier_stats[tier]
+    stats["calls"] += 1
+    stats["prompt_tokens"] += prompt_tokens or 0
+    stats["completion_tokens"] += completion_tokens or 0
+    stats["total_latency_ms"] += (time.perf_counter() - start) * 1000
+
+def _record_openai_usage(tier, start, response):
+    usage = getattr(response, "usage", None)
+    _record_tier(
+        tier, start,
+        getattr(usage, "prompt_tokens", 0),
+        getattr(usage, "completion_tokens", 0),
+    )
+
+def _record_gemini_usage(tier, start, response):
+    usage = getattr(response, "usage_metadata", None)
+    _record_tier(
+        tier, start,
+        getattr(usage, "prompt_token_count", 0),
+        getattr(usage, "candidates_token_count", 0),
+    )
+
+def record_economy_escalation():
+    global _economy_escalations
+    _economy_escalations += 1
+
+def get_analysis_stats() -> dict:
+    result = {"mode": ANALYSIS_MODE}
+    for tier, stats in _tier_stats.items():
+        calls = stats["calls"]
+        result[tier] = {
+            **stats,
+            "total_latency_ms": round(stats["total_latency_ms"], 2),
+            "avg_latency_ms": round(stats["total_latency_ms"] / calls, 2) if calls else 0.0,
+            "avg_tokens": round((stats["prompt_tokens"] + stats["completion_tokens"]) / calls, 1) if calls else 0.0,
+        }
+    economy_calls = _tier_stats["economy"]["calls"]
+    result["economy"]["escalations"] = _economy_escalations
+    result["economy"]["escalation_rate"] = round(_economy_escalations / economy_calls, 3) if economy_calls else 0.0
+    return result
+
+# --- Economy (first pass) analysis ---
+
+ECONOMY_PROMPT = (
+    "사진 속 수산물의 어종을 식별하세요. 대부분 한국 어시장의 흔한 어종입니다."
+    "{length_info} "
+    "물고기/해산물이 아니면 is_fish=false. "
+    "marketPrice는 원 단위 예상 싯가, estimatedWeight는 kg 단위 예상 무게, "
+    "confidence는 어종 식별에 대한 확신도(0~1)입니다."
+)
+
+# Compact structured-output schema shared by both providers
+ECONOMY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "is_fish": {"type": "boolean"},
+        "scientific_name": {"type": ["string", "null"]},
+        "seafoodType": {"type": ["string", "null"]},
+        "marketPrice": {"type": ["integer", "null"]},
+        "estimatedWeight": {"type": ["number", "null"]},
+        "confidence": {"type": "number"},
+    },
+    "required": ["is_fish", "scientific_name", "seafoodType", "marketPrice", "estimatedWeight", "confidence"],
+    "additionalProperties": False,
+}
+
+def _economy_prompt(fish_length):
+    length_info = f" 추정 길이는 {fish_length}cm 입니다." if fish_length else ""
+    return ECONOMY_PROMPT.format(length_info=length_info)
+
+def _accept_economy_result(result_text, fish_length):
+    """
+    Returns the result as the usual JSON string if it passes schema validation and
+    the confidence threshold, otherwise None (caller escalates to the full pass).
+    """
+    try:
+        data = json.loads(result_text)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get("is_fish"), bool):
+        return None
+
+    confidence = data.pop("confidence", None)
+    if not isinstance(confidence, (int, float)) or confidence < ECONOMY_MIN_CONFIDENCE:
+        return None
+
+    if data["is_fish"]:
+        if not data.get("seafoodType") or not isinstance(data.get("seafoodType"), str):
+            return None
+        weight = data.get("estimatedWeight")
+        if not isinstance(weight, (int, float)) or weight <= 0:
+            return None
+
+        scientific_name = data.get("scientific_name")
+        if fish_length and scientific_name:
+            try:
+                data["estimatedWeight"] = round(calculate_weight(scientific_name, float(fish_length)), 2)
+            except Exception as e:
+                print(f"Warning: Failed to calculate scientific weight: {e}")
+
+    return json.dumps(data, ensure_ascii=False)
+
+def analyze_economy_with_gpt(base64_image, api_key, fish_length=None, timeout=None):
+    """
+    Economy first pass with GPT-4o: low-detail small image + compact JSON schema.
+    Returns the JSON string, or None if the result should be escalated.
+    """
+    try:
+        from openai import OpenAI
+    except ImportError:
+        return None
+
+    client = _openai_client(OpenAI, api_key, timeout)
+    # Every attempt is recorded, failed ones included, so escalation_rate stays <= 1
+    start = time.perf_counter()
+    response = None
+    try:
+        response = client.chat.completions.create(
+            model="gpt-4o",
+            messages=[
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": _economy_prompt(fish_length)},
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": f"data:image/jpeg;base64,{base64_image}",
+                                "detail": "low",
+                            },
+                        },
+                    ],
+                }
+            ],
+            response_format={
+                "type": "json_schema",
+                "json_schema": {"name": "fish_economy", "strict": True, "schema": ECONOMY_SCHEMA},
+            },
+            max_tokens=120,
+        )
+        return _accept_economy_result(response.choices[0].message.content, fish_length)
+    except Exception as e:
+        print(f"Economy GPT pass failed, escalating: {e}")
+        return None
+    finally:
+        _record_openai_usage("economy", start, response)
+
+def analyze_economy_with_gemini(image_bytes, api_key, fish_length=None, timeout=None):
+    """
+    Economy first pass with Gemini: small image at low media resolution + compact JSON schema.
+    Returns the JSON string, or None if the result should be escalated.
+    """
+    try:
+        from google import genai
+        from google.genai import types
+    except ImportError:
+        return None
+
+    client = _gemini_client(genai, api_key, timeout)
+    start = time.perf_counter()
+    response = None
+    try:
+        response = client.models.generate_content(
+            model='gemini-2.0-flash',
+            contents=[_economy_prompt(fish_length), types.Part.from_bytes(data=image_bytes, mime_type="image/jpeg")],
+            config={
+                'response_mime_type': 'application/json',
+                'response_json_schema': ECONOMY_SCHEMA,
+                'media_resolution': 'MEDIA_RESOLUTION_LOW',
+                'max_output_tokens': 120,
+            }
+        )
+        return _accept_economy_result(response.text, fish_length)
+    except Exception as e:
+        print(f"Economy Gemini pass failed, escalating: {e}")
+        return None
+    finally:
+        _record_gemini_usage("economy", start, response)
@@ -0,0 +1,91 @@
+import os
+import time
+import secrets
+from collections import OrderedDict
+from typing import Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Short-lived store linking a /fish/analyze result (and its image) to the
+# following /merchant/record call, so the photo is uploaded only once.
+# In-process: a token is only valid on the worker that issued it.
+ANALYSIS_TOKEN_TTL = int(os.environ.get("ANALYSIS_TOKEN_TTL", "600"))  # seconds
+ANALYSIS_STORE_MAX_BYTES = int(os.environ.get("ANALYSIS_STORE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+
+class StoredAnalysis:
+    __slots__ = ("image", "filename", "content_type", "analysis", "expires_at")
+
+    def __init__(self, image: bytes, filename: str, content_type: str, analysis: dict):
+        self.image = image
+        self.filename = filename
+        self.content_type = content_type
+        self.analysis = analysis
+        self.expires_at = time.monotonic() + ANALYSIS_TOKEN_TTL
+
+
+# token -> StoredAnalysis, oldest first
+_entries: "OrderedDict[str, StoredAnalysis]" = OrderedDict()
+_total_bytes = 0
+
+
+def _evict(token: str):
+    global _total_bytes
+    entry = _entries.pop(token, None)
+    if entry is not None:
+        _total_bytes -= len(entry.image)
+
+
+def _evict_expired():
+    now = time.monotonic()
+    # Entries share one TTL, so insertion order is expiry order (restored entries
+    # are the exception; they are only evicted late, take_analysis checks them)
+    while _entries:
+        token, entry = next(iter(_entries.items()))
+        if entry.expires_at > now:
+            break
+        _evict(token)
+
+
+def _insert(token: str, entry: StoredAnalysis):
+    global _total_bytes
+    # Drop the oldest entries to stay within the memory budget
+    while _entries and _total_bytes + len(entry.image) > ANALYSIS_STORE_MAX_BYTES:
+        _evict(next(iter(_entries)))
+    _entries[token] = entry
+    _total_bytes += len(entry.image)
+
+
+def put_analysis(image: bytes, filename: str, content_type: str, analysis: dict) -> Optional[str]:
+    """
+    Stores the image + analysis and returns a token for /merchant/record.
+    Returns None (nothing stored) when the image alone exceeds the memory budget.
+    """
+    _evict_expired()
+    if len(image) > ANALYSIS_STORE_MAX_BYTES:
+        return None
+    token = secrets.token_urlsafe(16)
+    _insert(token, StoredAnalysis(image, filename, content_type, analysis))
+    return token
+
+
+def take_analysis(token: str) -> Optional[StoredAnalysis]:
+    """
+    Removes and returns the entry: tokens are single use, so a second concurrent
+    /merchant/record with the same token finds nothing. See restore_analysis.
+    """
+    _evict_expired()
+    entry = _entries.get(token)
+    if entry is None:
+        return None
+    _evict(token)
+    if entry.expires_at <= time.monotonic():
+        return None  # restored entries can sit behind newer ones, so check each
+    return entry
+
+
+def restore_analysis(token: str, entry: StoredAnalysis):
+    """Puts a taken entry back (until its original expiry) when the record wasn't created."""
+    if entry.expires_at > time.monotonic() and token not in _entries:
+        _insert(token, entry)
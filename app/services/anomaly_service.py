@@ -0,0 +1,151 @@
+import math
+from typing import Dict, List, Optional, Tuple
+from sortedcontainers import SortedList
+from sqlalchemy.orm import Session
+from app.models import MerchantRecord
+
+# Honesty metric per record: how much heavier the merchant's declared weight is
+# than the AI estimate, relative to the estimate.
+#     r = (merchant_weight - estimated_weight) / estimated_weight
+# r is z-scored against the running distribution for the same species (or all
+# species while that one has too few samples). Only over-declaration (z > 0)
+# counts as an anomaly, since that is what overcharges the customer.
+#
+# The state lives in-process: it is rebuilt from the DB at startup, then only sees
+# inserts handled by this worker. With several workers each one scores against,
+# and ranks stalls from, a different subset of recent records until it restarts.
+
+ANOMALY_Z_THRESHOLD = 2.5
+MIN_SPECIES_SAMPLES = 5
+MIN_STALL_RECORDS = 3
+# Coordinates are rounded to this many decimals (~11 m) to identify a stall
+LOCATION_PRECISION = 4
+
+
+class RunningStats:
+    """Welford's streaming mean / variance."""
+
+    __slots__ = ("count", "mean", "m2")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x: float):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+
+class _StallState:
+    __slots__ = ("z", "anomalies")
+
+    def __init__(self):
+        self.z = RunningStats()
+        self.anomalies = 0
+
+
+class HonestyScorer:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.global_stats = RunningStats()
+        self.species: Dict[str, RunningStats] = {}
+        self.stalls: Dict[Tuple[float, float], _StallState] = {}
+        # (-mean_z, stall_key) for stalls with at least MIN_STALL_RECORDS scored records
+        self.ranking = SortedList()
+
+    @staticmethod
+    def _ratio(estimated_weight, merchant_weight) -> Optional[float]:
+        if not estimated_weight or merchant_weight is None or estimated_weight <= 0:
+            return None
+        return (merchant_weight - estimated_weight) / estimated_weight
+
+    @staticmethod
+    def stall_key(lat, lng) -> Optional[Tuple[float, float]]:
+        if lat is None or lng is None:
+            return None
+        return round(lat, LOCATION_PRECISION), round(lng, LOCATION_PRECISION)
+
+    def score(self, seafood_type, estimated_weight, merchant_weight) -> Tuple[Optional[float], bool]:
+        """z-score and anomaly flag for a new record, from the current state (read-only)."""
+        r = self._ratio(estimated_weight, merchant_weight)
+        if r is None:
+            return None, False
+
+        stats = self.species.get(seafood_type)
+        if stats is None or stats.count < MIN_SPECIES_SAMPLES:
+            stats = self.global_stats
+        if stats.count < MIN_SPECIES_SAMPLES or stats.std == 0.0:
+            return None, False
+
+        z = (r - stats.mean) / stats.std
+        return z, z >= ANOMALY_Z_THRESHOLD
+
+    def observe(self, seafood_type, estimated_weight, merchant_weight, lat, lng, z, is_anomaly):
+        """Folds a committed record into the running state. O(log stalls)."""
+        r = self._ratio(estimated_weight, merchant_weight)
+        if r is None:
+            return
+        self.global_stats.add(r)
+        if seafood_type:
+            self.species.setdefault(seafood_type, RunningStats()).add(r)
+
+        key = self.stall_key(lat, lng)
+        if key is None or z is None:
+            return
+        stall = self.stalls.get(key)
+        if stall is None:
+            stall = self.stalls[key] = _StallState()
+        if stall.z.count >= MIN_STALL_RECORDS:
+            self.ranking.remove((-stall.z.mean, key))
+        stall.z.add(z)
+        if is_anomaly:
+            stall.anomalies += 1
+        if stall.z.count >= MIN_STALL_RECORDS:
+            self.ranking.add((-stall.z.mean, key))
+
+    def top_stalls(self, limit: int) -> List[dict]:
+        result = []
+        for neg_mean, key in self.ranking[:limit]:
+            stall = self.stalls[key]
+            result.append({
+                "latitude": key[0],
+                "longitude": key[1],
+                "records": stall.z.count,
+                "meanZScore": round(-neg_mean, 3),
+                "anomalies": stall.anomalies,
+            })
+        return result
+
+
+scorer = HonestyScorer()
+
+
+def warm_up(db: Session):
+    """
+    Rebuilds the in-memory state once at startup by replaying records in insert order.
+    After that every insert only updates the state incrementally.
+    """
+    scorer.reset()
+    rows = (
+        db.query(
+            MerchantRecord.seafood_type,
+            MerchantRecord.estimated_weight,
+            MerchantRecord.merchant_weight,
+            MerchantRecord.latitude,
+            MerchantRecord.longitude,
+        )
+        .order_by(MerchantRecord.id)
+        .yield_per(1000)
+    )
+    for seafood_type, estimated_weight, merchant_weight, lat, lng in rows:
+        z, is_anomaly = scorer.score(seafood_type, estimated_weight, merchant_weight)
+        scorer.observe(seafood_type, estimated_weight, merchant_weight, lat, lng, z, is_anomaly)
@@ -0,0 +1,117 @@
+import os
+import math
+from collections import Counter
+from typing import List, Tuple
+from sqlalchemy.orm import Session
+from cachetools import TTLCache
+from dotenv import load_dotenv
+from app.models import MerchantRecord
+
+load_dotenv()
+
+# Tiles are a plain lat/lng grid: at zoom z a tile spans 360 / 2^z degrees on both axes.
+# Each tile is split into CLUSTER_GRID x CLUSTER_GRID cells; every non-empty cell is one cluster.
+MIN_ZOOM = 0
+MAX_ZOOM = 20
+CLUSTER_GRID = 8
+MAX_TILES_PER_REQUEST = 64
+
+# Inserts invalidate their tile only in the worker that handled them. With several
+# workers the other workers' cached tiles miss that record until they expire, so
+# the TTL bounds how stale a tile can get.
+CLUSTER_TILE_TTL = int(os.environ.get("CLUSTER_TILE_TTL", "60"))  # seconds
+
+# (zoom, tile_x, tile_y) -> list of cluster dicts
+_tile_cache: TTLCache = TTLCache(maxsize=4096, ttl=CLUSTER_TILE_TTL)
+
+def _tile_size(zoom: int) -> float:
+    return 360.0 / (2 ** zoom)
+
+def _tile_index(lat: float, lng: float, zoom: int) -> Tuple[int, int]:
+    size = _tile_size(zoom)
+    return int(math.floor((lng + 180.0) / size)), int(math.floor((lat + 90.0) / size))
+
+def count_tiles_for_bbox(min_lat: float, min_lng: float, max_lat: float, max_lng: float, zoom: int) -> int:
+    x0, y0 = _tile_index(min_lat, min_lng, zoom)
+    x1, y1 = _tile_index(max_lat, max_lng, zoom)
+    return (x1 - x0 + 1) * (y1 - y0 + 1)
+
+def tiles_for_bbox(min_lat: float, min_lng: float, max_lat: float, max_lng: float, zoom: int) -> List[Tuple[int, int]]:
+    x0, y0 = _tile_index(min_lat, min_lng, zoom)
+    x1, y1 = _tile_index(max_lat, max_lng, zoom)
+    return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+def _build_tile(zoom: int, tx: int, ty: int, db: Session) -> List[dict]:
+    size = _tile_size(zoom)
+    lng0 = tx * size - 180.0
+    lat0 = ty * size - 90.0
+    cell = size / CLUSTER_GRID
+
+    rows = (
+        db.query(
+            MerchantRecord.latitude,
+            MerchantRecord.longitude,
+            MerchantRecord.seafood_type,
+            MerchantRecord.market_price,
+        )
+        .filter(
+            MerchantRecord.latitude >= lat0,
+            MerchantRecord.latitude < lat0 + size,
+            MerchantRecord.longitude >= lng0,
+            MerchantRecord.longitude < lng0 + size,
+        )
+        .all()
+    )
+
+    # cell -> [count, lat_sum, lng_sum, price_sum, price_count, Counter(seafood_type)]
+    cells = {}
+    for lat, lng, seafood_type, price in rows:
+        cx = min(int((lng - lng0) / cell), CLUSTER_GRID - 1)
+        cy = min(int((lat - lat0) / cell), CLUSTER_GRID - 1)
+        acc = cells.get((cx, cy))
+        if acc is None:
+            acc = cells[(cx, cy)] = [0, 0.0, 0.0, 0, 0, Counter()]
+        acc[0] += 1
+        acc[1] += lat
+        acc[2] += lng
+        if price is not None:
+            acc[3] += price
+            acc[4] += 1
+        if seafood_type:
+            acc[5][seafood_type] += 1
+
+    clusters = []
+    for count, lat_sum, lng_sum, price_sum, price_count, types in cells.values():
+        clusters.append({
+            "latitude": lat_sum / count,
+            "longitude": lng_sum / count,
+            "count": count,
+            "seafoodType": types.most_common(1)[0][0] if types else None,
+            "avgPrice": int(price_sum / price_count) if price_count else None,
+        })
+    return clusters
+
+def get_clusters(min_lat: float, min_lng: float, max_lat: float, max_lng: float, zoom: int, db: Session) -> List[dict]:
+    """
+    Returns pre-aggregated clusters for every tile touching the bounding box.
+    Tiles are cached until a record lands in them (see invalidate_record_tiles).
+    """
+    clusters = []
+    for tx, ty in tiles_for_bbox(min_lat, min_lng, max_lat, max_lng, zoom):
+        key = (zoom, tx, ty)
+        tile = _tile_cache.get(key)
+        if tile is None:
+            tile = _build_tile(zoom, tx, ty, db)
+            _tile_cache[key] = tile
+        for c in tile:
+            if min_lat <= c["latitude"] <= max_lat and min_lng <= c["longitude"] <= max_lng:
+                clusters.append(c)
+    return clusters
+
+def invalidate_record_tiles(lat: float, lng: float):
+    """Drops the cached tile containing (lat, lng) at every zoom level."""
+    if lat is None or lng is None:
+        return
+    for zoom in range(MIN_ZOOM, MAX_ZOOM + 1):
+        tx, ty = _tile_index(lat, lng, zoom)
+        _tile_cache.pop((zoom, tx, ty), None)
@@ -0,0 +1,59 @@
+import os
+import time
+import asyncio
+from typing import Optional
+from fastapi import Request
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Overall time budget for one request. Clients may ask for a shorter one with
+# the X-Deadline-Ms header; it is capped at REQUEST_DEADLINE_SECONDS.
+REQUEST_DEADLINE_SECONDS = float(os.environ.get("REQUEST_DEADLINE_SECONDS", "30"))
+DEADLINE_HEADER = "x-deadline-ms"
+
+
+class DeadlineExceeded(Exception):
+    """A required stage ran out of request budget."""
+
+
+class Deadline:
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+    def budget(self, cap: Optional[float] = None) -> float:
+        """Time a stage may use: what is left, optionally capped by the stage's own limit."""
+        remaining = self.remaining()
+        return remaining if cap is None else min(cap, remaining)
+
+
+def get_request_deadline(request: Request) -> Deadline:
+    """FastAPI dependency: the deadline for this request."""
+    seconds = REQUEST_DEADLINE_SECONDS
+    header = request.headers.get(DEADLINE_HEADER)
+    if header:
+        try:
+            seconds = min(max(float(header) / 1000.0, 0.0), REQUEST_DEADLINE_SECONDS)
+        except ValueError:
+            pass
+    return Deadline(seconds)
+
+
+async def run_with_deadline(awaitable, deadline: Deadline, cap: Optional[float] = None):
+    """Awaits a stage within the remaining budget, raising DeadlineExceeded if it runs out."""
+    budget = deadline.budget(cap)
+    if budget <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise DeadlineExceeded()
+    try:
+        return await asyncio.wait_for(awaitable, budget)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded()
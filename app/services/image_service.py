@@ -0,0 +1,118 @@
+import os
+import io
+import time
+import base64
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Number of worker processes for CPU-bound image work (decode, EXIF, resize, base64).
+# 0 disables the pool; work then runs in the default thread pool instead.
+IMAGE_POOL_WORKERS = int(os.environ.get("IMAGE_POOL_WORKERS", "2"))
+
+# Longest side (px) of the image sent to the AI models. 0 keeps the original size.
+ANALYSIS_IMAGE_MAX_SIDE = int(os.environ.get("ANALYSIS_IMAGE_MAX_SIDE", "2048"))
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+_stats = {
+    "workers": 0,
+    "queued": 0,        # submitted but not finished yet
+    "max_queued": 0,
+    "completed": 0,
+    "failed": 0,
+    "total_task_ms": 0.0,   # time spent inside the worker
+    "max_task_ms": 0.0,
+    "total_wait_ms": 0.0,   # time spent waiting for a free worker (+ IPC)
+}
+
+
+def start_image_pool():
+    """Starts the worker pool. Called from the app lifespan."""
+    global _pool
+    if _pool is None and IMAGE_POOL_WORKERS > 0:
+        _pool = ProcessPoolExecutor(max_workers=IMAGE_POOL_WORKERS)
+        _stats["workers"] = IMAGE_POOL_WORKERS
+
+
+def shutdown_image_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+        _stats["workers"] = 0
+
+
+def get_image_pool_stats() -> dict:
+    stats = dict(_stats)
+    for key in ("total_task_ms", "max_task_ms", "total_wait_ms"):
+        stats[key] = round(stats[key], 2)
+    # The totals only include completed tasks (a failed task has no timing)
+    completed = stats["completed"]
+    stats["avg_task_ms"] = round(stats["total_task_ms"] / completed, 2) if completed else 0.0
+    stats["avg_wait_ms"] = round(stats["total_wait_ms"] / completed, 2) if completed else 0.0
+    return stats
+
+
+def _timed_call(fn, *args):
+    """Runs inside the worker. Returns (result, elapsed_seconds)."""
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+async def run_image_task(fn, *args):
+    """
+    Runs a CPU-bound image function off the event loop and records queue depth / task time.
+    fn and args must be picklable; prefer passing file paths over raw bytes so the
+    input never has to be copied through the pool pipe.
+    """
+    loop = asyncio.get_running_loop()
+    _stats["queued"] += 1
+    _stats["max_queued"] = max(_stats["max_queued"], _stats["queued"])
+    start = time.perf_counter()
+    try:
+        result, elapsed = await loop.run_in_executor(_pool, _timed_call, fn, *args)
+    except Exception:
+        _stats["failed"] += 1
+        raise
+    finally:
+        _stats["queued"] -= 1
+
+    task_ms = elapsed * 1000
+    wall_ms = (time.perf_counter() - start) * 1000
+    _stats["completed"] += 1
+    _stats["total_task_ms"] += task_ms
+    _stats["max_task_ms"] = max(_stats["max_task_ms"], task_ms)
+    _stats["total_wait_ms"] += max(wall_ms - task_ms, 0.0)
+    return result
+
+
+# --- Worker functions (module level so they can be pickled) ---
+
+def prepare_analysis_image(image_path: str, max_side: int = ANALYSIS_IMAGE_MAX_SIDE) -> bytes:
+    """
+    Decodes the image, applies the EXIF orientation, downsizes it so the longest
+    side is at most max_side and re-encodes it as JPEG.
+    """
+    import PIL.Image
+    import PIL.ImageOps
+
+    with PIL.Image.open(image_path) as img:
+        img = PIL.ImageOps.exif_transpose(img)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        if max_side and max(img.size) > max_side:
+            img.thumbnail((max_side, max_side))
+
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=90)
+        return buf.getvalue()
+
+
+def encode_analysis_image(image_path: str, max_side: int = ANALYSIS_IMAGE_MAX_SIDE) -> str:
+    """prepare_analysis_image + base64 encoding, for the OpenAI data URL."""
+    return base64.b64encode(prepare_analysis_image(image_path, max_side)).decode('utf-8')
@@ -1,43 +1,209 @@
+import os
+import math
+import time
+import asyncio
+import itertools
 import httpx
 import urllib.parse
-from typing import Optional
+from functools import lru_cache
+from typing import Dict, Optional
+from cachetools import TTLCache
+from dotenv import load_dotenv
+
+load_dotenv()
 
 BASE_URL = "https://pub-api.tpirates.com/v2/www/retail-price"
 
-async def get_market_price(fish_name: str) -> Optional[float]:
-    """
-    Fetches the market price (avgPrice per kg) from 'The Pirates' (tpirates.com) public API.
-    Ref: test/tpriateWrapper/apitest.ipynb
-    """
+# The regional price table of a species is fetched once and reused for this long
+PRICE_TABLE_TTL = int(os.environ.get("PRICE_TABLE_TTL", "3600"))  # seconds
+# Same page size as the notebook; content holds search matches, not regions
+PRICE_TABLE_PAGE_SIZE = 6
+
+# Region centroids (lat, lng) used to resolve a coordinate to its price region.
+# Keys are the canonical short names; aliases are the spellings the API may use.
+REGION_CENTROIDS = {
+    "서울": (37.5665, 126.9780),
+    "부산": (35.1796, 129.0756),
+    "대구": (35.8714, 128.6014),
+    "인천": (37.4563, 126.7052),
+    "광주": (35.1595, 126.8526),
+    "대전": (36.3504, 127.3845),
+    "울산": (35.5384, 129.3114),
+    "세종": (36.4800, 127.2890),
+    "경기": (37.4138, 127.5183),
+    "강원": (37.8228, 128.1555),
+    "충북": (36.6357, 127.4917),
+    "충남": (36.5184, 126.8000),
+    "전북": (35.7175, 127.1530),
+    "전남": (34.8679, 126.9910),
+    "경북": (36.4919, 128.8889),
+    "경남": (35.4606, 128.2132),
+    "제주": (33.4890, 126.4983),
+}
+REGION_ALIASES = {
+    "충북": ("충청북도",),
+    "충남": ("충청남도",),
+    "전북": ("전라북도", "전북특별자치도"),
+    "전남": ("전라남도",),
+    "경북": ("경상북도",),
+    "경남": ("경상남도",),
+}
+# Fields a per-region row may carry its region name in. Not confirmed against a live
+# response: when none match, the table has no regions and the national price is used.
+_REGION_KEYS = ("regionName", "region", "areaName", "area", "sido")
+
+
+class PriceTable:
+    """avgPrice (per kg) of one species: national default plus per-region prices."""
+
+    __slots__ = ("default_price", "regions", "version", "loaded_at")
+
+    def __init__(self, default_price: Optional[float], regions: Dict[str, float]):
+        self.default_price = default_price
+        self.regions = regions
+        self.version = 0  # unique per fetch, see price_table_version
+        self.loaded_at = time.monotonic()
+
+    def ttl_remaining(self) -> float:
+        """Seconds until this table expires from the cache (and its prices may change)."""
+        return max(PRICE_TABLE_TTL - (time.monotonic() - self.loaded_at), 0.0)
+
+    def price_for(self, latitude: Optional[float] = None, longitude: Optional[float] = None) -> Optional[float]:
+        if latitude is not None and longitude is not None and self.regions:
+            region = nearest_region(round(latitude, 2), round(longitude, 2))
+            if region in self.regions:
+                return self.regions[region]
+        return self.default_price
+
+
+_tables: TTLCache = TTLCache(maxsize=512, ttl=PRICE_TABLE_TTL, timer=time.monotonic)
+# Fetches in progress, so concurrent requests for one species share a single upstream call
+_inflight: Dict[str, asyncio.Future] = {}
+# Source of PriceTable.version
+_table_versions = itertools.count(1)
+
+
+@lru_cache(maxsize=65536)
+def nearest_region(latitude: float, longitude: float) -> str:
+    """Nearest region centroid. Callers round coordinates (~1 km) so results are cached."""
+    cos_lat = math.cos(math.radians(latitude))
+    best, best_d = None, float("inf")
+    for region, (lat, lng) in REGION_CENTROIDS.items():
+        d = (latitude - lat) ** 2 + ((longitude - lng) * cos_lat) ** 2
+        if d < best_d:
+            best, best_d = region, d
+    return best
+
+
+def _canonical_region(name) -> Optional[str]:
+    if not isinstance(name, str):
+        return None
+    for region in REGION_CENTROIDS:
+        if region in name or any(alias in name for alias in REGION_ALIASES.get(region, ())):
+            return region
+    return None
+
+
+def _parse_price_table(content: list) -> PriceTable:
+    # Notebook logic: "Most relevant result is at index 0. First avgPrice is per kg."
+    default_price = content[0].get("avgPrice")
+    default_price = float(default_price) if default_price is not None else None
+
+    # content is a relevance-ranked list of different products, so only region rows
+    # nested in the best match belong to this species
+    candidates = []
+    for value in content[0].values():
+        if isinstance(value, list):
+            candidates.extend(v for v in value if isinstance(v, dict))
+
+    regions = {}
+    for row in candidates:
+        price = row.get("avgPrice")
+        if price is None:
+            continue
+        region = next((_canonical_region(row[k]) for k in _REGION_KEYS if k in row), None)
+        if region and region not in regions:
+            regions[region] = float(price)
+
+    return PriceTable(default_price, regions)
+
+
+async def _fetch_price_table(fish_name: str, timeout: float) -> Optional[PriceTable]:
     try:
         encoded_name = urllib.parse.quote(fish_name)
-        endpoint = f"/price/aggregate/region?keyword={encoded_name}&orderState=default&page=0&size=6"
+        endpoint = f"/price/aggregate/region?keyword={encoded_name}&orderState=default&page=0&size={PRICE_TABLE_PAGE_SIZE}"
         url = f"{BASE_URL}{endpoint}"
-        
+
         async with httpx.AsyncClient() as client:
-            response = await client.get(url, timeout=10.0)
-            
+            response = await client.get(url, timeout=timeout)
+
             if response.status_code != 200:
                 print(f"Market Price API Error: {response.status_code}")
                 return None
-            
+
             data = response.json()
             # The structure is data['content'] which is a list.
             content = data.get("content", [])
-            
+
             if not content:
                 print(f"No price data found for {fish_name}")
                 return None
-            
-            # Notebook logic: "Most relevant result is at index 0. First avgPrice is per kg."
-            # content[0] usually contains keys like "name", "avgPrice", "minPrice", etc.
-            avg_price = content[0].get("avgPrice")
-            
-            if avg_price is not None:
-                return float(avg_price)
-            
-            return None
-            
+
+            table = _parse_price_table(content)
+            table.version = next(_table_versions)
+            _tables[fish_name] = table
+            return table
+
     except Exception as e:
         print(f"Error fetching market price: {e}")
         return None
+
+
+async def get_price_table(fish_name: str, timeout: float = 10.0) -> Optional[PriceTable]:
+    """Regional price table for a species: from cache, or one upstream call shared by concurrent callers."""
+    table = _tables.get(fish_name)
+    if table is not None:
+        return table
+
+    future = _inflight.get(fish_name)
+    if future is None:
+        future = asyncio.ensure_future(_fetch_price_table(fish_name, timeout))
+        _inflight[fish_name] = future
+        future.add_done_callback(lambda _: _inflight.pop(fish_name, None))
+    # Shielded so one caller giving up (deadline) doesn't cancel the fetch for the others
+    return await asyncio.shield(future)
+
+
+async def get_market_price(fish_name: str, timeout: float = 10.0,
+                           latitude: Optional[float] = None, longitude: Optional[float] = None) -> Optional[float]:
+    """
+    Fetches the market price (avgPrice per kg) from 'The Pirates' (tpirates.com) public API.
+    With coordinates, the price of the nearest region is used when the API has one.
+    Ref: test/tpriateWrapper/apitest.ipynb
+    """
+    table = await get_price_table(fish_name, timeout)
+    if table is None:
+        return None
+    return table.price_for(latitude, longitude)
+
+
+def peek_price_table(fish_name: Optional[str]) -> Optional[PriceTable]:
+    """Cached table of a species, if any. Never calls the upstream API."""
+    return _tables.get(fish_name) if fish_name else None
+
+
+def peek_regional_price(fish_name: Optional[str], latitude: Optional[float], longitude: Optional[float]) -> Optional[float]:
+    """Like get_market_price but cache-only: never calls the upstream API."""
+    table = peek_price_table(fish_name)
+    if table is None:
+        return None
+    return table.price_for(latitude, longitude)
+
+
+def price_table_version(fish_name: Optional[str]) -> int:
+    """
+    Changes whenever the regional prices of this species can change: when its table
+    is fetched (unique version) and when it expires (back to 0). Part of record view ETags.
+    """
+    table = peek_price_table(fish_name)
+    return table.version if table is not None else 0
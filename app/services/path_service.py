@@ -1,7 +1,33 @@
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 from sqlalchemy.orm import Session
 from app.models import MerchantRecord
+from cachetools import TTLCache
+from dotenv import load_dotenv
 import math
+import os
+import uuid
+
+load_dotenv()
+
+# Route sessions are kept in memory so follow-up edits don't hit the DB
+# or recompute the whole tour.
+ROUTE_SESSION_TTL = int(os.environ.get("ROUTE_SESSION_TTL", "1800"))  # seconds
+ROUTE_SESSION_MAX = int(os.environ.get("ROUTE_SESSION_MAX", "1000"))
+
+# How many positions around an edited spot the local 2-opt repair looks at.
+TWO_OPT_WINDOW = 3
+
+def _distance(a: Tuple[float, float], b: Tuple[float, float]) -> float:
+    # Simple Euclidean Distance
+    return math.sqrt((a[0] - b[0])**2 + (a[1] - b[1])**2)
+
+def _fetch_coords(points: List[int], db: Session) -> Dict[int, Tuple[float, float]]:
+    records = (
+        db.query(MerchantRecord.id, MerchantRecord.latitude, MerchantRecord.longitude)
+        .filter(MerchantRecord.id.in_(points))
+        .all()
+    )
+    return {r.id: (r.latitude, r.longitude) for r in records}
 
 def calculate_best_path(points: List[int], db: Session) -> List[int]:
     """
@@ -12,67 +38,65 @@ def calculate_best_path(points: List[int], db: Session) -> List[int]:
         return points
 
     # 1. Fetch Coordinates
-    records = db.query(MerchantRecord).filter(MerchantRecord.id.in_(points)).all()
-    coords = {r.id: (r.latitude, r.longitude) for r in records}
-    
+    coords = _fetch_coords(points, db)
+
     # Filter points that exist in DB to avoid errors
     valid_points = [p for p in points if p in coords]
     if len(valid_points) < 2:
         return valid_points
 
+    return _mst_preorder_path(valid_points, coords)
+
+def _mst_preorder_path(valid_points: List[int], coords: Dict[int, Tuple[float, float]]) -> List[int]:
     # 2. Prim's Algorithm for MST
     # We use a dense graph implementation O(V^2)
     mst_adj = {p: [] for p in valid_points}
-    
+
     # Start with the first point in the list as the root
     start_node = valid_points[0]
     visited = set()
-    
+
     # min_dist stores current shortest distance from standard tree to node
     # key: node_id, value: (distance, parent_node_id)
     min_dist = {p: (float('inf'), None) for p in valid_points}
     min_dist[start_node] = (0, None)
-    
+
     # Loop until all nodes are visited
     while len(visited) < len(valid_points):
         # Extract Min: Find unvisited node with smallest distance
         current_node = None
         current_min_d = float('inf')
-        
+
         for p in valid_points:
             if p not in visited:
                 d, parent = min_dist[p]
                 if d < current_min_d:
                     current_min_d = d
                     current_node = p
-        
+
         if current_node is None:
             break # Should not happen in connected graph
-            
+
         visited.add(current_node)
         parent_node = min_dist[current_node][1]
-        
+
         # Add edge to MST
         if parent_node is not None:
              mst_adj[parent_node].append(current_node)
              mst_adj[current_node].append(parent_node)
-        
+
         # Update distances to neighbors
-        cur_lat, cur_lon = coords[current_node]
-        
         for neighbor in valid_points:
             if neighbor not in visited:
-                n_lat, n_lon = coords[neighbor]
-                # Simple Euclidean Distance
-                dist = math.sqrt((cur_lat - n_lat)**2 + (cur_lon - n_lon)**2)
-                
+                dist = _distance(coords[current_node], coords[neighbor])
+
                 if dist < min_dist[neighbor][0]:
                     min_dist[neighbor] = (dist, current_node)
 
     # 3. Preorder Traversal (DFS) to generate path
     final_path = []
     visited_dfs = set()
-    
+
     def dfs(u):
         visited_dfs.add(u)
         final_path.append(u)
@@ -80,7 +104,130 @@ def calculate_best_path(points: List[int], db: Session) -> List[int]:
         for v in mst_adj[u]:
             if v not in visited_dfs:
                 dfs(v)
-                
+
     dfs(start_node)
-    
+
     return final_path
+
+# --- Route sessions (incremental updates) ---
+
+class RouteSession:
+    """
+    A route being edited by a user: the visiting order plus the pairwise
+    distance matrix of its points. The first point is the fixed start.
+    """
+
+    def __init__(self, route_id: str, path: List[int], coords: Dict[int, Tuple[float, float]]):
+        self.route_id = route_id
+        self.path = path
+        self.coords = coords
+        self.dist = {
+            p: {q: _distance(coords[p], coords[q]) for q in path}
+            for p in path
+        }
+
+    def add(self, point: int, coord: Tuple[float, float]):
+        """Cheapest insertion of a new point, then a local 2-opt repair. O(n)."""
+        self.coords[point] = coord
+        row = {q: _distance(coord, self.coords[q]) for q in self.path}
+        for q, d in row.items():
+            self.dist[q][point] = d
+        row[point] = 0.0
+        self.dist[point] = row
+
+        if not self.path:
+            self.path.append(point)
+            return
+
+        # Insert between path[i-1] and path[i], or append at the end (i == len).
+        # Position 0 is never used so the start point stays fixed.
+        best_i = len(self.path)
+        best_cost = row[self.path[-1]]
+        for i in range(1, len(self.path)):
+            a, b = self.path[i - 1], self.path[i]
+            cost = row[a] + row[b] - self.dist[a][b]
+            if cost < best_cost:
+                best_cost = cost
+                best_i = i
+
+        self.path.insert(best_i, point)
+        self._two_opt_around(best_i)
+
+    def remove(self, point: int):
+        """Removes a point and reconnects its neighbours, then a local 2-opt repair."""
+        i = self.path.index(point)
+        self.path.pop(i)
+        del self.dist[point]
+        for row in self.dist.values():
+            row.pop(point, None)
+        self.coords.pop(point, None)
+        if self.path:
+            self._two_opt_around(max(i - 1, 0))
+
+    def _two_opt_around(self, center: int):
+        """
+        2-opt on the open path, only trying segment reversals whose first edge
+        starts within TWO_OPT_WINDOW positions of center.
+        Reversing path[i..j] swaps edges (i-1, i) and (j, j+1) for (i-1, j) and (i, j+1).
+        """
+        path, dist = self.path, self.dist
+        n = len(path)
+        improved = True
+        while improved:
+            improved = False
+            lo = max(1, center - TWO_OPT_WINDOW)
+            hi = min(n - 1, center + TWO_OPT_WINDOW)
+            for i in range(lo, hi + 1):
+                for j in range(i + 1, n):
+                    a, b, c = path[i - 1], path[i], path[j]
+                    old = dist[a][b]
+                    new = dist[a][c]
+                    if j + 1 < n:
+                        d = path[j + 1]
+                        old += dist[c][d]
+                        new += dist[b][d]
+                    if new < old - 1e-12:
+                        path[i:j + 1] = reversed(path[i:j + 1])
+                        improved = True
+
+_route_sessions: TTLCache = TTLCache(maxsize=ROUTE_SESSION_MAX, ttl=ROUTE_SESSION_TTL)
+
+def create_route_session(points: List[int], db: Session) -> RouteSession:
+    """Builds the initial tour (same algorithm as calculate_best_path) and stores it."""
+    coords = _fetch_coords(points, db) if points else {}
+    valid_points = list(dict.fromkeys(p for p in points if p in coords))
+    if len(valid_points) >= 2:
+        path = _mst_preorder_path(valid_points, coords)
+    else:
+        path = valid_points
+
+    session = RouteSession(uuid.uuid4().hex, path, coords)
+    _route_sessions[session.route_id] = session
+    return session
+
+def get_route_session(route_id: str) -> Optional[RouteSession]:
+    session = _route_sessions.get(route_id)
+    if session is not None:
+        # Refresh the TTL on access
+        _route_sessions[route_id] = session
+    return session
+
+def add_route_point(session: RouteSession, point: int, db: Session) -> bool:
+    """Returns False if the record doesn't exist. Adding a point already on the route is a no-op."""
+    if point in session.dist:
+        return True
+    coords = _fetch_coords([point], db)
+    if point not in coords:
+        return False
+    session.add(point, coords[point])
+    return True
+
+def remove_route_point(session: RouteSession, point: int) -> bool:
+    """Returns False if the point is not on the route."""
+    if point not in session.dist:
+        return False
+    session.remove(point)
+    return True
+
+def delete_route_session(route_id: str) -> bool:
+    return _route_sessions.pop(route_id, None) is not None
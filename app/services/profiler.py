@@ -0,0 +1,245 @@
+import os
+import sys
+import time
+import hmac
+import random
+import asyncio
+import threading
+from collections import Counter, deque
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# On-demand request profiling. Off unless PROFILING_TOKEN is set; when off the
+# middleware isn't even installed (see main.py), so there is no per-request cost.
+# A request is profiled when it carries the token in X-Profile-Token, or at random
+# with probability PROFILE_SAMPLE_RATE. The same token guards the admin endpoints.
+PROFILING_TOKEN = os.environ.get("PROFILING_TOKEN", "").strip()
+PROFILING_ENABLED = bool(PROFILING_TOKEN)
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_BUFFER_SIZE = int(os.environ.get("PROFILE_BUFFER_SIZE", "20"))
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", "5"))
+PROFILE_HEADER = "x-profile-token"
+_PROFILE_HEADER_BYTES = PROFILE_HEADER.encode()
+
+
+class Profile:
+    """Stack samples of one request, split into on-CPU and awaiting."""
+
+    def __init__(self, profile_id: int, method: str, path: str, reason: str,
+                 task: asyncio.Task, root_frame, loop_thread_id: int):
+        self.id = profile_id
+        self.method = method
+        self.path = path
+        self.reason = reason  # "header" | "sampled"
+        self.status: Optional[int] = None
+        self.started_at = datetime.now(timezone.utc)
+        self.start = time.perf_counter()
+        self.duration_ms = 0.0
+        # (kind, frame labels outermost first) -> sample count
+        self.samples: Counter = Counter()
+        # Seconds attributed to each kind; ticks are weighted by the measured gap
+        # since the previous one, which is often longer than the interval (GIL)
+        self.seconds = {"cpu": 0.0, "await": 0.0}
+        # Ticks where walking the stack raised; reported so an empty profile isn't silent
+        self.failed_samples = 0
+        self._task = task
+        self._root_frame = root_frame
+        self._loop_thread_id = loop_thread_id
+
+    def summary(self) -> dict:
+        cpu = sum(n for (kind, _), n in self.samples.items() if kind == "cpu")
+        waiting = sum(self.samples.values()) - cpu
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "reason": self.reason,
+            "startedAt": self.started_at.isoformat(),
+            "durationMs": round(self.duration_ms, 2),
+            "samples": cpu + waiting,
+            "failedSamples": self.failed_samples,
+            # Estimates from sampling, not measured times
+            "cpuMs": round(self.seconds["cpu"] * 1000, 2),
+            "awaitMs": round(self.seconds["await"] * 1000, 2),
+        }
+
+    def collapsed(self, kind: Optional[str] = None) -> str:
+        """Brendan Gregg's collapsed-stack format, one `frame;frame;... count` per line."""
+        root = f"{self.method} {self.path}"
+        lines = []
+        for (sample_kind, frames), count in sorted(self.samples.items()):
+            if kind and sample_kind != kind:
+                continue
+            lines.append(";".join((root, sample_kind) + frames) + f" {count}")
+        return "\n".join(lines) + ("\n" if lines else "")
+
+
+_labels: Dict[object, str] = {}
+
+
+def _label(code) -> str:
+    label = _labels.get(code)
+    if label is None:
+        module = os.path.splitext(os.path.basename(code.co_filename))[0]
+        # co_qualname is 3.11+; plain function names on older versions
+        label = _labels[code] = f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+    return label
+
+
+def _await_chain(coro) -> list:
+    """(frame or awaited object) chain of a suspended coroutine, outermost first."""
+    chain = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            chain.append(coro)  # a Future (or other awaitable) the innermost coroutine waits on
+            break
+        chain.append(frame)
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return chain
+
+
+def _sample(profile: Profile, thread_frames: dict, elapsed: float):
+    coro = profile._task.get_coro()
+    if getattr(coro, "cr_running", False):
+        # The request's task holds the event loop right now: take the real thread stack
+        kind = "cpu"
+        chain = []
+        frame = thread_frames.get(profile._loop_thread_id)
+        while frame is not None:
+            chain.append(frame)
+            frame = frame.f_back
+        chain.reverse()
+    else:
+        kind = "await"
+        chain = _await_chain(coro)
+
+    # Drop server/framework frames above the profiling middleware
+    try:
+        chain = chain[chain.index(profile._root_frame) + 1:]
+    except ValueError:
+        pass
+
+    frames = tuple(
+        _label(item.f_code) if hasattr(item, "f_code") else f"<{type(item).__name__}>"
+        for item in chain
+    )
+    profile.samples[(kind, frames)] += 1
+    profile.seconds[kind] += elapsed
+
+
+class _Sampler:
+    """One daemon thread that samples every active profile; idles while there are none."""
+
+    def __init__(self):
+        self.active: Dict[int, Profile] = {}
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def add(self, profile: Profile):
+        with self.lock:
+            self.active[profile.id] = profile
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self.thread.start()
+        self.wake.set()
+
+    def remove(self, profile: Profile):
+        with self.lock:
+            self.active.pop(profile.id, None)
+
+    def _run(self):
+        interval = PROFILE_INTERVAL_MS / 1000.0
+        last = time.perf_counter()
+        while True:
+            with self.lock:
+                profiles = list(self.active.values())
+                if not profiles:
+                    self.wake.clear()
+            if not profiles:
+                self.wake.wait()
+                last = time.perf_counter()
+                continue
+            now = time.perf_counter()
+            thread_frames = sys._current_frames()
+            for profile in profiles:
+                # A profile added since the last tick only gets the time it has existed
+                elapsed = now - max(last, profile.start)
+                try:
+                    _sample(profile, thread_frames, elapsed)
+                except Exception:
+                    # Usually the task moved on mid-walk; counted, not recorded
+                    profile.failed_samples += 1
+            del thread_frames
+            last = now
+            time.sleep(interval)
+
+
+_sampler = _Sampler()
+_profiles: deque = deque(maxlen=PROFILE_BUFFER_SIZE)
+_next_id = 0
+
+
+def check_token(token: Optional[str]) -> bool:
+    if not PROFILING_ENABLED or token is None:
+        return False
+    return hmac.compare_digest(token.encode("utf-8"), PROFILING_TOKEN.encode("utf-8"))
+
+
+def list_profiles() -> List[dict]:
+    """Finished profiles in the ring buffer, newest first."""
+    return [p.summary() for p in reversed(_profiles)]
+
+
+def get_profile(profile_id: int) -> Optional[Profile]:
+    return next((p for p in _profiles if p.id == profile_id), None)
+
+
+class ProfilingMiddleware:
+    """Pure ASGI middleware (doesn't buffer responses, so streaming endpoints are unaffected)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def _reason(self, scope) -> Optional[str]:
+        for name, value in scope["headers"]:
+            if name == _PROFILE_HEADER_BYTES:
+                if check_token(value.decode("latin-1")):
+                    return "header"
+                break
+        if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+            return "sampled"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        reason = self._reason(scope) if scope["type"] == "http" else None
+        if reason is None:
+            await self.app(scope, receive, send)
+            return
+
+        global _next_id
+        _next_id += 1
+        profile = Profile(
+            _next_id, scope["method"], scope["path"], reason,
+            asyncio.current_task(), sys._getframe(), threading.get_ident(),
+        )
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+            await send(message)
+
+        _sampler.add(profile)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _sampler.remove(profile)
+            profile.duration_ms = (time.perf_counter() - profile.start) * 1000
+            # Frames aren't needed once sampling stops; don't keep them alive in the buffer
+            profile._task = profile._root_frame = None
+            _profiles.append(profile)
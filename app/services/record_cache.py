@@ -0,0 +1,68 @@
+import os
+import uuid
+from typing import Callable, FrozenSet, Optional, Tuple
+from cachetools import LRUCache, TTLCache
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Merchant records are never modified after insert, so a cached row never goes stale.
+# Rows (column tuples) are cached rather than response dicts, because the regional
+# price in a record view is derived at response time.
+RECORD_CACHE_SIZE = int(os.environ.get("RECORD_CACHE_SIZE", "10000"))
+RECORD_CACHE_MAX_AGE = int(os.environ.get("RECORD_CACHE_MAX_AGE", "3600"))  # Cache-Control cap for details
+# How long a list page may be revalidated from memory without querying the DB
+RECORDS_PAGE_TTL = int(os.environ.get("RECORDS_PAGE_TTL", "60"))  # seconds
+
+# record id -> column tuple
+_record_cache: LRUCache = LRUCache(maxsize=RECORD_CACHE_SIZE)
+
+# The boot id keeps detail ETags from a previous process from matching.
+_boot_id = uuid.uuid4().hex[:8]
+
+# Bumped on every insert in this process; keys the page memo below so a local insert
+# is seen right away. Inserts by other workers (or outside the app) only bump their
+# own counter, which is why the memo expires after RECORDS_PAGE_TTL.
+_records_version = 0
+
+# (version, page, size) -> (rows tag, species on that page), from the last time the
+# page was queried. Lets a conditional list request build its ETag without the DB.
+_page_state: TTLCache = TTLCache(maxsize=1024, ttl=RECORDS_PAGE_TTL)
+
+def record_etag(record_id: int, price_version: int) -> str:
+    # Records never change, but the regional price shown with them does
+    return f'"record-{record_id}-{_boot_id}-p{price_version}"'
+
+def get_record_row(record_id: int, load: Callable[[int], Optional[tuple]]) -> Optional[tuple]:
+    """
+    Read-through cache for record rows.
+    load(record_id) is called on a miss and returns the row or None if not found.
+    Misses for unknown ids are not cached.
+    """
+    row = _record_cache.get(record_id)
+    if row is not None:
+        return row
+    row = load(record_id)
+    if row is None:
+        return None
+    _record_cache[record_id] = row
+    return row
+
+def put_record_row(record_id: int, row: tuple):
+    _record_cache[record_id] = row
+
+def bump_records_version():
+    """Call after a new record is committed; drops this worker's page memo."""
+    global _records_version
+    _records_version += 1
+
+def get_page_state(page: int, size: int) -> Optional[Tuple[str, FrozenSet[str]]]:
+    return _page_state.get((_records_version, page, size))
+
+def put_page_state(page: int, size: int, rows_tag: str, species: FrozenSet[str]):
+    _page_state[(_records_version, page, size)] = (rows_tag, species)
+
+def records_list_etag(page: int, size: int, rows_tag: str, price_tag: str) -> str:
+    # Derived from the page content (records are immutable, so the ids identify the
+    # rows) and the prices shown with them; the same on every worker.
+    return f'W/"records-{rows_tag}-p{price_tag}-{page}-{size}"'
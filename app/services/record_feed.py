@@ -0,0 +1,153 @@
+import os
+import asyncio
+from abc import ABC, abstractmethod
+from typing import Callable, Iterable, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Live feed of newly committed merchant records.
+# The in-process broker only sees records inserted by this worker. For several
+# workers, a broker that publishes via Postgres NOTIFY and LISTENs to feed its
+# local subscribers can implement the same RecordFeedBroker interface.
+FEED_QUEUE_SIZE = int(os.environ.get("FEED_QUEUE_SIZE", "100"))
+FEED_HEARTBEAT_SECONDS = 15.0
+# Max records replayed from the DB when resuming from an id (or after lagging)
+FEED_REPLAY_LIMIT = 500
+
+
+class FeedFilter:
+    """Optional bounding box and species filter for one subscriber."""
+
+    __slots__ = ("bbox", "seafood_type")
+
+    def __init__(self, bbox: Optional[Tuple[float, float, float, float]] = None, seafood_type: Optional[str] = None):
+        self.bbox = bbox  # (min_lat, min_lng, max_lat, max_lng)
+        self.seafood_type = seafood_type
+
+    def matches(self, latitude, longitude, seafood_type) -> bool:
+        if self.seafood_type and seafood_type != self.seafood_type:
+            return False
+        if self.bbox:
+            if latitude is None or longitude is None:
+                return False
+            min_lat, min_lng, max_lat, max_lng = self.bbox
+            if not (min_lat <= latitude <= max_lat and min_lng <= longitude <= max_lng):
+                return False
+        return True
+
+
+class FeedEvent:
+    __slots__ = ("record_id", "record")
+
+    def __init__(self, record_id: int, record: dict):
+        self.record_id = record_id
+        self.record = record
+
+
+class Subscription:
+    def __init__(self, feed_filter: FeedFilter):
+        self.filter = feed_filter
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=FEED_QUEUE_SIZE)
+        # Set when events were dropped because the queue was full;
+        # the consumer catches up from the DB (see iter_feed)
+        self.lagged = False
+
+    def offer(self, event: FeedEvent):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.lagged = True
+
+
+class RecordFeedBroker(ABC):
+    """Fan-out interface. publish() is called after a record is committed."""
+
+    @abstractmethod
+    def publish(self, record_id: int, record: dict, latitude, longitude, seafood_type):
+        ...
+
+    @abstractmethod
+    def subscribe(self, feed_filter: FeedFilter) -> Subscription:
+        ...
+
+    @abstractmethod
+    def unsubscribe(self, subscription: Subscription):
+        ...
+
+
+class InProcessBroker(RecordFeedBroker):
+    def __init__(self):
+        self.subscribers = set()
+
+    def publish(self, record_id: int, record: dict, latitude, longitude, seafood_type):
+        event = FeedEvent(record_id, record)
+        for sub in list(self.subscribers):
+            if sub.filter.matches(latitude, longitude, seafood_type):
+                sub.offer(event)
+
+    def subscribe(self, feed_filter: FeedFilter) -> Subscription:
+        sub = Subscription(feed_filter)
+        self.subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, subscription: Subscription):
+        self.subscribers.discard(subscription)
+
+
+broker: RecordFeedBroker = InProcessBroker()
+
+
+async def iter_feed(feed_filter: FeedFilter, since_id: Optional[int],
+                    replay: Callable[[int, FeedFilter], Iterable[FeedEvent]],
+                    latest_id: Callable[[], int]):
+    """
+    Yields FeedEvents for new records, or None every FEED_HEARTBEAT_SECONDS while idle.
+    With since_id, records committed after it are replayed from the DB first.
+    replay(after_id, filter) returns at most FEED_REPLAY_LIMIT events in id order;
+    latest_id() returns the highest record id. Both query the DB, so they run in a
+    worker thread to keep the event loop free.
+    """
+    # Subscribe before replaying so nothing committed in between is missed
+    sub = broker.subscribe(feed_filter)
+    try:
+        if since_id is None:
+            # Live only: the cursor starts at the newest record, so catching up after
+            # lagging replays just what was dropped, never the whole table
+            last_id = await asyncio.to_thread(latest_id)
+            catch_up = False
+        else:
+            last_id = since_id
+            catch_up = True
+        # Queued events up to this id were already sent by a replay
+        sent_through = since_id or 0
+
+        while True:
+            if catch_up or sub.lagged:
+                # Resume / queue overflow: drop the queue and read what was missed from the DB.
+                # Anything committed meanwhile is queued again and deduplicated by id below.
+                catch_up = False
+                sub.lagged = False
+                while not sub.queue.empty():
+                    sub.queue.get_nowait()
+                while True:
+                    batch = list(await asyncio.to_thread(replay, last_id, feed_filter))
+                    for event in batch:
+                        last_id = event.record_id
+                        yield event
+                    if len(batch) < FEED_REPLAY_LIMIT:
+                        break
+                sent_through = last_id
+                continue
+
+            try:
+                event = await asyncio.wait_for(sub.queue.get(), FEED_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield None
+                continue
+            if event.record_id <= sent_through:
+                continue
+            last_id = max(last_id, event.record_id)
+            yield event
+    finally:
+        broker.unsubscribe(sub)
@@ -1,45 +1,92 @@
 import os
-from supabase import create_client, Client
+import asyncio
+import tempfile
+from supabase import create_client, Client, ClientOptions
 import uuid
+import hashlib
 
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
 BUCKET_NAME = os.environ.get("SUPABASE_BUCKET_NAME")
 
-def get_supabase_client() -> Client:
+# Merchant uploads are streamed through in chunks of this size instead of read whole
+UPLOAD_CHUNK_SIZE = 64 * 1024
+MERCHANT_UPLOAD_MAX_BYTES = int(os.environ.get("MERCHANT_UPLOAD_MAX_BYTES", str(10 * 1024 * 1024)))
+
+class UploadTooLarge(Exception):
+    pass
+
+def get_supabase_client(timeout: float = None) -> Client:
     if not SUPABASE_URL or not SUPABASE_KEY:
         raise ValueError("Supabase credentials not set in .env")
+    if timeout is not None:
+        options = ClientOptions(storage_client_timeout=max(int(timeout), 1))
+        return create_client(SUPABASE_URL, SUPABASE_KEY, options=options)
     return create_client(SUPABASE_URL, SUPABASE_KEY)
 
-async def upload_file(file_content: bytes, filename: str, content_type: str = "image/jpeg") -> str:
+def compute_image_hash(file_content: bytes) -> str:
+    return hashlib.sha256(file_content).hexdigest()
+
+async def spool_upload(upload, max_bytes: int = MERCHANT_UPLOAD_MAX_BYTES):
+    """
+    Copies an UploadFile to a temp file chunk by chunk, hashing as it goes, so the
+    image is never held in memory as a whole. Returns (temp_path, sha256 hex).
+    Raises UploadTooLarge past max_bytes. The caller removes the temp file.
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    suffix = os.path.splitext(upload.filename or "")[1]
+    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+    try:
+        with temp_file:
+            while True:
+                chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+                hasher.update(chunk)
+                temp_file.write(chunk)
+    except BaseException:
+        os.remove(temp_file.name)
+        raise
+    return temp_file.name, hasher.hexdigest()
+
+async def upload_file(file_content, filename: str, content_type: str = "image/jpeg", content_hash: str = None, timeout: float = None) -> str:
     """
     Uploads a file to Supabase Storage and returns the public URL.
-    Generates a unique filename to prevent collisions.
+    file_content is either bytes or the path of a local file; a path is streamed
+    to storage in chunks by the HTTP client instead of being loaded into memory.
+    With content_hash the object is stored under the hash, so the same image is
+    only ever stored once; otherwise a unique filename is generated.
+    timeout: seconds left in the request budget (None = client default).
     """
+    # The supabase client is synchronous, so run it in a thread to keep the event loop free
+    return await asyncio.to_thread(_upload_file_sync, file_content, filename, content_type, content_hash, timeout)
+
+def _upload_file_sync(file_content, filename: str, content_type: str, content_hash: str, timeout: float) -> str:
     if not BUCKET_NAME:
         raise ValueError("SUPABASE_BUCKET_NAME not set in .env")
 
-    client = get_supabase_client()
+    client = get_supabase_client(timeout)
     
     # Generate unique path
     ext = os.path.splitext(filename)[1]
-    unique_filename = f"{uuid.uuid4()}{ext}"
+    unique_filename = f"{content_hash or uuid.uuid4()}{ext}"
     path = f"merchant_uploads/{unique_filename}"
     
-    # Upload
-    # Note: 'upload' is synchronous in the python client usually? 
-    # The python client is sync by default unless async client used. 
-    # Standard `create_client` returns a sync client.
-    # We'll run it synchronously for now or wrap it if needed.
-    # Fastapi handles sync endpoints in threadpool, async endpoints need non-blocking calls.
-    # If storage call is blocking, we should ideally run it in a thread or use async client.
-    # But for simplicity, let's call it directly. If it blocks, it blocks this request.
-    
-    res = client.storage.from_(BUCKET_NAME).upload(
-        path=path,
-        file=file_content,
-        file_options={"content-type": content_type}
-    )
+    # Upload (sync client; upload_file runs this in a worker thread)
+    try:
+        res = client.storage.from_(BUCKET_NAME).upload(
+            path=path,
+            file=file_content,
+            file_options={"content-type": content_type}
+        )
+    except Exception as e:
+        # Hash-keyed object already stored (e.g. by a concurrent request): reuse it
+        if not (content_hash and ("Duplicate" in str(e) or "409" in str(e))):
+            raise
     
     # Get Public URL
     # The new python client might return response object differently.
@@ -0,0 +1,73 @@
+"""
+Serialization cost of the /merchant/records payload, per 1k records.
+
+before: ORM objects -> _map_record_to_detail -> ResponseModel validation
+        -> jsonable_encoder -> JSONResponse (stdlib json)
+after:  column tuples -> _map_row_to_detail -> FastJSONResponse (orjson)
+
+Run from the repo root:
+    python test/bench_record_serialization.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from app.models import MerchantRecord
+from app.schemas import ResponseModel
+from app.responses import FastJSONResponse
+from app.api.endpoints.merchant import _map_record_to_detail, _map_row_to_detail, _record_row
+
+N_RECORDS = 1000
+REPEAT = 20
+
+
+def make_records(n):
+    return [
+        MerchantRecord(
+            id=i,
+            seafood_type="고등어",
+            scientific_name="Scomber japonicus",
+            currently_forbidden=False,
+            market_price=30000 + i,
+            estimated_weight=0.5 + i / 1000,
+            merchant_weight=0.55 + i / 1000,
+            latitude=35.1 + i / 1e5,
+            longitude=129.0 + i / 1e5,
+            image_filename=f"https://example.supabase.co/storage/v1/object/public/bucket/merchant_uploads/{i}.jpg",
+        )
+        for i in range(n)
+    ]
+
+
+def to_rows(records):
+    return [_record_row(r) for r in records]
+
+
+def before(records):
+    payload = {"status": "success", "data": {"record": [_map_record_to_detail(r) for r in records]}}
+    validated = ResponseModel.model_validate(payload)
+    return JSONResponse(jsonable_encoder(validated)).body
+
+
+def after(rows):
+    payload = {"status": "success", "data": {"record": [_map_row_to_detail(r) for r in rows]}}
+    return FastJSONResponse(payload).body
+
+
+if __name__ == "__main__":
+    records = make_records(N_RECORDS)
+    rows = to_rows(records)
+
+    t_before = min(timeit.repeat(lambda: before(records), number=1, repeat=REPEAT))
+    t_after = min(timeit.repeat(lambda: after(rows), number=1, repeat=REPEAT))
+
+    print(f"records per call : {N_RECORDS}")
+    print(f"before           : {t_before * 1000:.2f} ms / 1k records")
+    print(f"after            : {t_after * 1000:.2f} ms / 1k records")
+    print(f"speedup          : {t_before / t_after:.1f}x")